@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible performance benchmarks for the Custom GPT chatbot.
+
+Generates a synthetic knowledge base (TXT, PDF, DOCX and XLSX files), then
+measures ingestion throughput and peak memory, retrieval latency percentiles
+for each retrieval mode, full LLMClient.get_response turn latency against
+a local stub of the Mistral API, and server mode throughput as the number of
+concurrent sessions grows. Results are written as JSON so runs can be
+compared:
+
+    python benchmark.py --files 200 --output bench_results.json
+    python benchmark.py --files 200 --compare bench_results.json
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+
+import docx
+import openpyxl
+import requests
+
+import main_updated as app
+from stub_server import StubMistralServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+WORDS = (
+    "account agent analysis api backup billing budget cache client cloud cluster "
+    "compliance contract customer dashboard data database deploy design device "
+    "engineer invoice latency license market metric migration mobile model network "
+    "office onboarding partner payment platform policy pricing product project "
+    "quality release report revenue roadmap security server service storage support "
+    "team training upgrade user vendor warehouse workflow"
+).split()
+
+FACT_TEMPLATES = [
+    "The {0} team in {1} owns the {2} roadmap.",
+    "Our {0} policy was updated by the {1} office for every {2} customer.",
+    "Each {0} report lists {1} metrics for the {2} platform.",
+]
+
+CITIES = ["Lahore", "Berlin", "Austin", "Nairobi", "Osaka", "Lima", "Oslo", "Perth"]
+
+# --- Synthetic corpus ---
+def make_paragraph(rng, num_words):
+    """A pseudo-random paragraph with a few retrievable fact sentences mixed in"""
+    words = [rng.choice(WORDS) for _ in range(num_words)]
+    fact = rng.choice(FACT_TEMPLATES).format(rng.choice(WORDS), rng.choice(CITIES), rng.choice(WORDS))
+    words.insert(rng.randrange(len(words) + 1), fact)
+    return " ".join(words)
+
+def write_pdf(path, pages):
+    """Write a minimal text PDF (one Helvetica text block per page) without extra dependencies"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for text in pages:
+        lines = textwrap.wrap(text, 90)
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({line}) '" for line in escaped) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(output)
+
+def generate_corpus(folder, num_files, words_per_file, seed, duplicates=0):
+    """
+    Fill folder with num_files documents rotating through TXT, PDF, DOCX and XLSX,
+    plus DOCX exports of the first `duplicates` TXT documents.
+
+    Returns:
+        dict: Number of files per type and total bytes written
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    counts = {"txt": 0, "pdf": 0, "docx": 0, "xlsx": 0}
+    kinds = list(counts)
+    exported = 0
+    for i in range(num_files):
+        kind = kinds[i % len(kinds)]
+        path = os.path.join(folder, f"doc_{i:05d}.{kind}")
+        paragraphs = [make_paragraph(rng, 80) for _ in range(max(1, words_per_file // 80))]
+        if kind == "txt":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraphs))
+            if exported < duplicates:
+                document = docx.Document()
+                for paragraph in paragraphs:
+                    document.add_paragraph(paragraph)
+                document.save(os.path.join(folder, f"doc_{i:05d}_export.docx"))
+                counts["docx"] += 1
+                exported += 1
+        elif kind == "pdf":
+            write_pdf(path, paragraphs)
+        elif kind == "docx":
+            document = docx.Document()
+            for paragraph in paragraphs:
+                document.add_paragraph(paragraph)
+            document.save(path)
+        else:
+            workbook = openpyxl.Workbook()
+            sheet = workbook.active
+            sheet.append(["Region", "Owner", "Product", "Notes"])
+            for paragraph in paragraphs:
+                sheet.append([rng.choice(CITIES), rng.choice(WORDS), rng.choice(WORDS), paragraph[:200]])
+            workbook.save(path)
+        counts[kind] += 1
+    total_bytes = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    return {"files": counts, "bytes": total_bytes}
+
+def make_queries(num_queries, seed):
+    rng = random.Random(seed + 1)
+    return [f"Which {rng.choice(WORDS)} team in {rng.choice(CITIES)} handles {rng.choice(WORDS)}?"
+            for _ in range(num_queries)]
+
+# --- Measurements ---
+def peak_rss_mb(who=None):
+    """Peak resident set size in MB for this process (or its children), if the platform reports it"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(who if who is not None else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 4),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1], 4),
+    }
+
+def _ingest_child(workdir, workers, results):
+    """Run cold and warm ingestion in a fresh process so peak RSS covers ingestion only"""
+    os.chdir(workdir)
+    app.console.quiet = True
+    started = time.perf_counter()
+    documents = app.load_knowledge_base(workers=workers)
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    app.load_knowledge_base(workers=workers)
+    warm = time.perf_counter() - started
+    results.put({
+        "chunks": len(documents),
+        "live_chunks": documents.live_count(),
+        "cold_seconds": round(cold, 4),
+        "warm_seconds": round(warm, 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "workers_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+    })
+
+def bench_ingest(workdir, corpus, workers):
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_ingest_child, args=(workdir, workers, results))
+    child.start()
+    stats = results.get()
+    child.join()
+    num_files = sum(corpus["files"].values())
+    stats["files_per_second"] = round(num_files / stats["cold_seconds"], 2)
+    stats["mb_per_second"] = round(corpus["bytes"] / 1e6 / stats["cold_seconds"], 3)
+    stats["chunks_per_second"] = round(stats["chunks"] / stats["cold_seconds"], 2)
+    return stats
+
+def bench_retrieval(documents, queries, modes):
+    results = {}
+    for mode in modes:
+        started = time.perf_counter()
+        retriever = app.build_retriever(documents, mode)
+        build_seconds = time.perf_counter() - started
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            retriever.search(query)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[mode] = dict(percentiles(samples), build_seconds=round(build_seconds, 4))
+    return results
+
+def bench_turns(queries, stub_delay):
+    """Full get_response / stream_response latency with the API replaced by a local stub"""
+    results = {}
+    with StubMistralServer(reply="Benchmark answer " * 40, delay=stub_delay) as server:
+        client = app.LLMClient("benchmark-key", app.UI())
+        client.ui.console.quiet = True
+        client.client.base_url = server.base_url
+        for name, run in (("get_response", client.get_response),
+                          ("stream_response", lambda q: "".join(client.stream_response(q)))):
+            samples = []
+            for query in queries:
+                started = time.perf_counter()
+                run(query)
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = percentiles(samples)
+        results["stub_delay_ms"] = stub_delay * 1000
+        results["connections"] = client.client.connection_stats()
+    return results
+
+def bench_server(queries, levels, turns_per_session, stub_delay):
+    """
+    Load test the HTTP server mode: `level` concurrent sessions each send
+    turns_per_session questions, against a stub API that takes stub_delay per answer.
+    """
+    results = {"stub_delay_ms": stub_delay * 1000}
+    with StubMistralServer(reply="Benchmark answer " * 40, delay=stub_delay) as stub:
+        client = app.LLMClient("benchmark-key", app.UI())
+        client.ui.console.quiet = True
+        client.client = app.MistralAI("benchmark-key", pool_size=max(levels))
+        client.client.base_url = stub.base_url
+        # Room for exactly every session the run creates: none of them may be evicted
+        server = app.ChatServer(client, workers=max(levels), max_sessions=sum(levels))
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        listener = asyncio.run_coroutine_threadsafe(server.start("127.0.0.1", 0), loop).result()
+        base_url = f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+
+        def user(index):
+            http = requests.Session()
+            session_id = http.post(f"{base_url}/sessions").json()["session_id"]
+            samples = []
+            for turn in range(turns_per_session):
+                started = time.perf_counter()
+                response = http.post(f"{base_url}/sessions/{session_id}/messages",
+                                     json={"message": queries[(index + turn) % len(queries)]})
+                response.raise_for_status()
+                samples.append((time.perf_counter() - started) * 1000)
+            return samples
+
+        for level in levels:
+            started = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(level) as pool:
+                samples = [sample for user_samples in pool.map(user, range(level)) for sample in user_samples]
+            elapsed = time.perf_counter() - started
+            results[f"sessions_{level}"] = dict(percentiles(samples), turns_per_second=round(len(samples) / elapsed, 2))
+        resident = len(server.sessions)
+        if resident != sum(levels):
+            raise RuntimeError(f"server kept {resident} of {sum(levels)} sessions below its capacity")
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    return results
+
+def bench_hedging(requests_count, stub_delay, slow_fraction, slow_delay):
+    """
+    Completion latency against two stub endpoints whose answers are occasionally
+    slow, sent to the first one directly and through a hedging EndpointRouter.
+    """
+    messages = [{"role": "user", "content": "How fast is the answer?"}]
+    results = {"stub_delay_ms": stub_delay * 1000, "slow_fraction": slow_fraction, "slow_delay_ms": slow_delay * 1000}
+    with StubMistralServer(delay=stub_delay, slow_fraction=slow_fraction, slow_delay=slow_delay, seed=1) as primary, \
+            StubMistralServer(delay=stub_delay, slow_fraction=slow_fraction, slow_delay=slow_delay, seed=2) as backup:
+        endpoints = []
+        for name, stub in (("primary", primary), ("backup", backup)):
+            client = app.MistralAI("benchmark-key", max_retries=0)
+            client.base_url = stub.base_url
+            endpoints.append(app.Endpoint(client, app.MODEL_NAME, name))
+        router = app.EndpointRouter(endpoints)
+        for name, client in (("direct", endpoints[0].client), ("hedged", router)):
+            samples = []
+            for _ in range(requests_count):
+                started = time.perf_counter()
+                client.chat_completion(messages)
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = percentiles(samples)
+        results["hedged"].update(hedges=router.connection_stats()["hedges"])
+    return results
+
+def compare(current, previous_path):
+    """Print the relative change of every numeric metric against a previous result file"""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+
+    def walk(now, before, prefix=""):
+        for key, value in now.items():
+            path = f"{prefix}{key}"
+            old = before.get(key) if isinstance(before, dict) else None
+            if isinstance(value, dict):
+                walk(value, old or {}, path + ".")
+            elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                change = (value - old) / old * 100
+                print(f"{path:55s} {old:>12} -> {value:>12}  ({change:+.1f}%)")
+
+    walk(current["results"], previous.get("results", {}))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and chat turn latency")
+    parser.add_argument("--files", type=int, default=40, help="number of synthetic documents")
+    parser.add_argument("--words", type=int, default=2000, help="approximate words per document")
+    parser.add_argument("--queries", type=int, default=200, help="retrieval queries to time")
+    parser.add_argument("--turns", type=int, default=20, help="chat turns to time against the stub API")
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="seconds the stub API waits per completion")
+    parser.add_argument("--workers", type=int, default=None, help="ingestion worker processes")
+    parser.add_argument("--duplicates", type=int, default=5, help="TXT documents also saved as DOCX, to exercise deduplication")
+    parser.add_argument("--server-sessions", default="1,4,16", help="concurrent session counts for the server load test")
+    parser.add_argument("--server-turns", type=int, default=10, help="turns per session in the server load test")
+    parser.add_argument("--server-delay", type=float, default=0.05, help="seconds the stub API waits per answer in the server load test")
+    parser.add_argument("--hedge-requests", type=int, default=300, help="completions sent in the hedging comparison")
+    parser.add_argument("--hedge-slow-fraction", type=float, default=0.03, help="share of stub answers delayed in the hedging comparison")
+    parser.add_argument("--modes", default="bm25,vector,hybrid", help="retrieval modes to time")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="PREVIOUS_JSON", help="print changes against an earlier result file")
+    args = parser.parse_args()
+
+    started = time.time()
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="customgpt-bench-") as workdir:
+        corpus = generate_corpus(os.path.join(workdir, app.KNOWLEDGE_FOLDER), args.files, args.words, args.seed, args.duplicates)
+        queries = make_queries(args.queries, args.seed)
+        ingest = bench_ingest(workdir, corpus, args.workers)
+
+        os.chdir(workdir)
+        try:
+            app.console.quiet = True
+            documents = app.load_knowledge_base()
+            retrieval = bench_retrieval(documents, queries, args.modes.split(","))
+            turns = bench_turns(queries[:args.turns], args.stub_delay)
+            levels = [int(level) for level in args.server_sessions.split(",")]
+            server = bench_server(queries, levels, args.server_turns, args.server_delay)
+            hedging = bench_hedging(args.hedge_requests, args.server_delay, args.hedge_slow_fraction, 1.0)
+        finally:
+            os.chdir(original_dir)
+
+    report = {
+        "timestamp": started,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "corpus": corpus,
+        "results": {"ingest": ingest, "retrieval": retrieval, "turns": turns, "server": server,
+                    "hedging": hedging},
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
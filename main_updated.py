@@ -1,21 +1,48 @@
 # -*- coding: utf-8 -*-
+import time
+_IMPORT_STARTED = time.perf_counter()
 import os
 import sys
-import time
+import hashlib
+import datetime
+import heapq
+import math
+import re
+import multiprocessing
+import zlib
+import mmap
+import io
+import array
+import struct
+import uuid
+import unicodedata
+import tempfile
+import shutil
+import contextlib
+import copy
+import functools
+from collections import Counter, OrderedDict, deque
 from pathlib import Path
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 import colorama
 from pwinput import pwinput
-import PyPDF2
-import docx
-import pandas as pd
+# Document parsers, NumPy and the heavier rich renderables are imported where they are
+# first needed, so the menu appears without paying for them
 from rich.console import Console
 from rich.panel import Panel
-from rich.markdown import Markdown
 from rich.text import Text
-from rich.live import Live
 import requests
 import json
+import random
+import threading
+import socket
+import email.utils
+import asyncio
+import queue
+import argparse
+import concurrent.futures
+import sqlite3
 
 # Initialize Colorama for cross-platform colored output
 colorama.init(autoreset=True)
@@ -29,6 +56,88 @@ MODEL_NAME = "mistral-small-latest"
 API_KEY_NAME = "API_KEY"
 BASE_URL = "https://api.mistral.ai/v1"
 ENV_FILE = ".env"
+STREAM_RESPONSES = True
+HISTORY_TOKEN_BUDGET = 4000  # estimated tokens of earlier turns re-sent with each question
+RESPONSE_TEMPERATURE = 0.7
+
+# Knowledge base settings
+KNOWLEDGE_FOLDER = "knowledge"
+CACHE_DIR = ".kb_cache"
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.xlsx', '.xls', '.txt', '.md']
+SPREADSHEET_EXTENSIONS = ['.xlsx', '.xls']
+SPREADSHEET_ROWS_PER_CHUNK = 50
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "bm25")  # bm25, vector or hybrid
+EMBEDDING_DIM = 512
+CONTEXT_TOKEN_BUDGET = 1500  # estimated tokens of retrieved passages sent with each question
+CONTEXT_CANDIDATES = 8  # chunks retrieved and cut down to passages to fill the budget
+SNIPPET_WORDS = 120  # longest passage taken from a chunk
+MMR_LAMBDA = 0.7  # relevance vs. diversity when picking passages (1 = relevance only)
+DUPLICATE_SIMILARITY = 0.5  # passages sharing this much of their word trigrams with a picked one are dropped
+PACK_CANDIDATES = 32  # best-scoring passages considered for packing
+PACK_MIN_WORDS = 12  # shortest cut-down passage worth sending when a whole one does not fit
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))  # 0 = one per CPU core
+INGEST_FILE_TIMEOUT = 120  # seconds before a single file is given up on
+LARGE_PDF_BYTES = 20 * 1024 * 1024  # PDFs above this size are split into page ranges
+PDF_PAGES_PER_TASK = 50
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "2"))  # seconds between knowledge folder scans (0 = off)
+KB_COMPACT_RATIO = 0.5  # reload fully once live updates have hidden or added this share of the base store
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))  # estimated similarity above which chunks are merged (0 = off)
+DEDUP_PERMUTATIONS = 64  # MinHash values per chunk
+DEDUP_BANDS = 16  # LSH bands; only chunks that agree on a whole band are compared
+DEDUP_SHINGLE_WORDS = 3
+
+# HTTP client settings
+CONNECT_TIMEOUT = 5  # seconds to establish a connection
+READ_TIMEOUT = 60  # seconds to wait between bytes of a response
+MAX_RETRIES = 3
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_MAX = 30
+BREAKER_FAILURE_THRESHOLD = 5  # consecutive failed requests before failing fast
+BREAKER_RESET_TIMEOUT = 30  # seconds before a trial request is let through
+HTTP_POOL_SIZE = 10
+
+# Multi-endpoint routing: a JSON list of OpenAI-compatible endpoints in order of preference, e.g.
+# API_ENDPOINTS='[{"base_url": "https://api.mistral.ai/v1", "model": "mistral-small-latest"},
+#                 {"base_url": "http://localhost:8080/v1", "model": "local", "api_key_env": "LOCAL_API_KEY"}]'
+API_ENDPOINTS = os.getenv("API_ENDPOINTS", "")
+HEDGE_PERCENTILE = 0.95  # duplicate a request to the next endpoint once it is slower than this share of recent calls
+HEDGE_DEFAULT_DELAY = 2.0  # seconds, used until an endpoint has HEDGE_MIN_SAMPLES latency samples
+HEDGE_MIN_DELAY = 0.05  # never hedge sooner than this
+HEDGE_MIN_SAMPLES = 20
+ROUTE_SLOWDOWN_FACTOR = 3.0  # endpoints whose median latency is this many times the fastest one's are tried last
+ROUTE_MIN_SAMPLES = 5  # latency samples needed before an endpoint's median affects routing
+ROUTE_EXPLORE_FRACTION = 0.05  # share of requests led by another endpoint to keep its latency estimate current
+BATCH_CONCURRENCY = 8
+
+# Server mode (--serve): many conversations sharing one knowledge base
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_WORKERS = 8  # turns processed at once; further requests wait for a free worker
+SERVER_MAX_SESSIONS = 1000  # least recently used sessions are evicted beyond this
+SERVER_SESSION_IDLE_TIMEOUT = 30 * 60  # seconds
+SERVER_MAX_BODY_BYTES = 1024 * 1024
+
+# Conversations are saved as append-only logs and can be resumed by session ID
+SESSIONS_DIR = os.getenv("SESSIONS_DIR", "sessions")  # empty = keep conversations in memory only
+SESSION_LOG_MAX_BYTES = 4 * 1024 * 1024  # compaction keeps at most this much of a conversation's newest turns
+
+# Response cache (opt-in): reuse answers to repeated questions with the same context
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite3")
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+# Retrieval cache: passages retrieved for recent questions, per knowledge base generation
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))  # results kept in memory (0 = off)
+
+# Successful API key checks are remembered (as a SHA-256 fingerprint) to skip /models on later starts
+VERIFIED_KEYS_PATH = os.path.join(CACHE_DIR, "verified_keys.json")
+API_KEY_VERIFY_TTL = 24 * 3600  # seconds
+
+# Performance metrics: shown by /stats, optionally traced to a JSONL file
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+METRICS_TRACE_PATH = os.getenv("METRICS_TRACE", "")  # e.g. trace.jsonl; empty = no trace file
+METRICS_PROMETHEUS_PATH = "metrics.prom"
 
 # UI Colors (Rich-compatible styles)
 class colors:
@@ -43,9 +152,194 @@ class colors:
     SYSTEM_TEXT = "magenta"
     RESET = ""
 
+# --- Performance Metrics ---
+class Metrics:
+    """
+    Timing spans and counters for each stage of a chat turn.
+
+    Spans keep their last SPAN_SAMPLES durations for percentiles plus running
+    totals, and are optionally appended to a JSONL trace file. When disabled,
+    span() returns a shared no-op context and timed() calls straight through,
+    so instrumentation costs a single attribute check.
+    """
+
+    SPAN_SAMPLES = 1000
+
+    def __init__(self, enabled=True, trace_path=None):
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.trace_file = None
+        self.spans = {}
+        self.counters = Counter()
+        self.turn = 0
+        self.lock = threading.Lock()
+        self._noop = contextlib.nullcontext()
+
+    def record(self, name, seconds, **attrs):
+        """Record one duration for a named stage"""
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = {"count": 0, "total": 0.0, "samples": deque(maxlen=self.SPAN_SAMPLES)}
+            span["count"] += 1
+            span["total"] += seconds
+            span["samples"].append(seconds)
+            if self.trace_path:
+                if self.trace_file is None:
+                    self.trace_file = open(self.trace_path, 'a', encoding='utf-8', buffering=1)
+                event = {"ts": round(time.time(), 6), "turn": self.turn, "span": name, "ms": round(seconds * 1000, 3)}
+                event.update(attrs)
+                self.trace_file.write(json.dumps(event) + "\n")
+
+    @contextlib.contextmanager
+    def _span(self, name, attrs):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, **attrs)
+
+    def span(self, name, **attrs):
+        """Context manager that times the enclosed block as stage `name`"""
+        if not self.enabled:
+            return self._noop
+        return self._span(name, attrs)
+
+    def timed(self, name):
+        """Decorator that times every call of a function as stage `name`"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def record_usage(self, usage):
+        """Add the token counts from an API response's `usage` object"""
+        if self.enabled and usage:
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                if usage.get(key):
+                    self.count(f"api.{key}", usage[key])
+
+    def summary(self):
+        """Per-stage count, mean, p50, p95 and max in milliseconds, plus counters"""
+        with self.lock:
+            stages = {}
+            for name, span in sorted(self.spans.items()):
+                samples = sorted(span["samples"])
+                stages[name] = {
+                    "count": span["count"],
+                    "mean_ms": round(span["total"] / span["count"] * 1000, 3),
+                    "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+                    "max_ms": round(samples[-1] * 1000, 3),
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def to_prometheus(self, prefix="customgpt"):
+        """Render all spans and counters in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each stage of a chat turn",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        with self.lock:
+            for name, span in sorted(self.spans.items()):
+                samples = sorted(span["samples"])
+                for quantile in (0.5, 0.95, 0.99):
+                    value = samples[min(len(samples) - 1, int(len(samples) * quantile))]
+                    lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{quantile}"}} {value:.6f}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {span["total"]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {span["count"]}')
+            lines.append(f"# HELP {prefix}_events_total Counted events and API token usage")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=METRICS_PROMETHEUS_PATH):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        return path
+
+metrics = Metrics(enabled=METRICS_ENABLED, trace_path=METRICS_TRACE_PATH or None)
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated request failures.
+
+    After failure_threshold consecutive failures the breaker opens and rejects
+    calls for reset_timeout seconds, then lets a single trial request through.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Whether a request may be sent now; once half-open, only the first caller gets the trial"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Claim the trial: others are rejected until it succeeds, or for another reset_timeout
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+def parse_retry_after(value):
+    """Return the delay in seconds from a Retry-After header (seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 # Mistral AI Client
 class MistralAI:
-    def __init__(self, api_key):
+    def __init__(self, api_key, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, pool_size=HTTP_POOL_SIZE):
         self.api_key = api_key
         self.base_url = BASE_URL
         self.headers = {
@@ -53,7 +347,86 @@ class MistralAI:
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self.retries = 0
+
+        # One keep-alive session so every turn reuses the same TCP+TLS connection
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff_delay(self, attempt, response=None):
+        """Exponential backoff with full jitter, overridden by a Retry-After header"""
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, BACKOFF_MAX)
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    def _request(self, method, endpoint, **kwargs):
+        """
+        Send a request through the pooled session, retrying connection errors,
+        timeouts, 429 and 5xx responses with backoff.
+
+        Raises:
+            CircuitOpenError: If the endpoint has been failing and the breaker is open
+            requests.exceptions.RequestException: If all attempts fail
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.base_url} is unavailable, not retrying for now")
+        
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, endpoint, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if last_attempt:
+                    self.breaker.record_failure()
+                    raise
+                self.retries += 1
+                time.sleep(self._backoff_delay(attempt))
+                continue
+            
+            if response.status_code in RETRY_STATUS_CODES:
+                metrics.count(f"api.http_{response.status_code}")
+                if last_attempt:
+                    self.breaker.record_failure()
+                    return response
+                self.retries += 1
+                delay = self._backoff_delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                continue
+            
+            self.breaker.record_success()
+            return response
+
+    def connection_stats(self):
+        """
+        Report pooled connection reuse for the API host.
+
+        Returns:
+            dict: requests sent, connections opened, requests that reused a
+            kept-alive connection, retries and circuit breaker state
+        """
+        pool_manager = self.session.get_adapter(self.base_url).poolmanager
+        host = urlparse(self.base_url).hostname
+        pools = [pool_manager.pools[key] for key in pool_manager.pools.keys() if key.key_host == host]
+        num_requests = sum(pool.num_requests for pool in pools)
+        num_connections = sum(pool.num_connections for pool in pools)
+        return {
+            "requests": num_requests,
+            "new_connections": num_connections,
+            "reused_connections": max(0, num_requests - num_connections),
+            "retries": self.retries,
+            "circuit_breaker": self.breaker.state,
+        }
 
+    @metrics.timed("api.chat_completion")
     def chat_completion(self, messages, model=MODEL_NAME, temperature=0.7, max_tokens=1000):
         """
         Send a chat completion request to Mistral AI API
@@ -79,19 +452,81 @@ class MistralAI:
         }
         
         try:
-            response = requests.post(endpoint, headers=self.headers, json=payload)
+            response = self._request("POST", endpoint, json=payload)
             if response.status_code == 401:
                 console.print("[red]Authentication Error: Please check your API key[/red]")
                 console.print(f"[red]Response: {response.text}[/red]")
                 return None
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+            metrics.record_usage(result.get('usage'))
+            return result
         except requests.exceptions.RequestException as e:
+            metrics.count("api.errors")
             console.print(f"[red]Error making API request: {e}[/red]")
             if hasattr(e, 'response') and e.response is not None:
                 console.print(f"[red]Response text: {e.response.text}[/red]")
             return None
 
+    def chat_completion_stream(self, messages, model=MODEL_NAME, temperature=0.7, max_tokens=1000, cancel=None):
+        """
+        Stream a chat completion from Mistral AI API as server-sent events
+        
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content'
+            model (str): Model to use (default: mistral-small-latest)
+            temperature (float): Controls randomness (0.0 to 1.0)
+            max_tokens (int): Maximum number of tokens to generate
+            cancel (StreamCancel): Lets another thread end the stream and drop its connection
+            
+        Yields:
+            str: Content deltas in the order they arrive
+        """
+        endpoint = f"{self.base_url}/chat/completions"
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "top_p": 1.0
+        }
+        headers = {"Accept": "text/event-stream"}
+        
+        started = time.perf_counter()
+        usage = {}
+        try:
+            with self._request("POST", endpoint, headers=headers, json=payload, stream=True) as response:
+                if response.status_code == 401:
+                    console.print("[red]Authentication Error: Please check your API key[/red]")
+                    console.print(f"[red]Response: {response.text}[/red]")
+                    return
+                response.raise_for_status()
+                if metrics.enabled:
+                    metrics.record("api.response_headers", time.perf_counter() - started)
+                # SSE is always UTF-8; without a charset requests would fall back to ISO-8859-1
+                response.encoding = 'utf-8'
+                if cancel:
+                    cancel.attach(response)
+                try:
+                    for delta in iter_sse_deltas(response.iter_lines(decode_unicode=True), usage):
+                        yield delta
+                finally:
+                    if cancel:
+                        cancel.detach()
+            if metrics.enabled:
+                metrics.record("api.chat_completion_stream", time.perf_counter() - started)
+                metrics.record_usage(usage)
+        except requests.exceptions.RequestException as e:
+            if cancel and cancel.is_set():
+                return
+            metrics.count("api.errors")
+            console.print(f"[red]Error making API request: {e}[/red]")
+            if hasattr(e, 'response') and e.response is not None:
+                console.print(f"[red]Response text: {e.response.text}[/red]")
+
+    @metrics.timed("api.list_models")
     def list_models(self):
         """
         Get list of available models
@@ -102,7 +537,7 @@ class MistralAI:
         endpoint = f"{self.base_url}/models"
         
         try:
-            response = requests.get(endpoint, headers=self.headers)
+            response = self._request("GET", endpoint)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -111,144 +546,2136 @@ class MistralAI:
                 console.print(f"[red]Response text: {e.response.text}[/red]")
             return None
 
+class StreamCancel:
+    """
+    Ends a streamed completion from another thread.
+
+    Closing a response does not wake a thread blocked reading it, so cancel()
+    shuts the socket down instead, which drops the connection. The stream
+    detaches its response once it ends, since its connection may then already
+    be back in the pool serving another request.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.response = None
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def _shutdown(self):
+        try:
+            fd = self.response.raw.fileno()
+        except (AttributeError, OSError, ValueError):
+            return
+        # Shutting down a duplicate descriptor acts on the shared socket but leaves the response's own to close
+        with contextlib.suppress(OSError), socket.socket(fileno=os.dup(fd)) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def attach(self, response):
+        with self.lock:
+            self.response = response
+            if self.event.is_set():
+                self._shutdown()
+
+    def detach(self):
+        with self.lock:
+            self.response = None
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            if self.response is not None:
+                self._shutdown()
+
+def iter_sse_deltas(lines, usage=None):
+    """
+    Parse server-sent event lines from a streaming chat completion into content deltas.
+    If a usage dict is given it is filled from the `usage` object sent with the last event.
+    """
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if usage is not None and event.get('usage'):
+            usage.update(event['usage'])
+        for choice in event.get('choices', []):
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                yield content
+
+# --- Endpoint Routing ---
+class LatencyHistogram:
+    """
+    Latency histogram with log-spaced buckets whose counts decay with every new
+    observation, so percentiles follow an endpoint that slows down or recovers.
+    """
+
+    BOUNDS = tuple(0.005 * 1.25 ** i for i in range(48))  # 5ms to ~200s
+
+    def __init__(self, decay=0.98):
+        self.decay = decay
+        self.counts = [0.0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        bucket = min(len(self.BOUNDS), max(0, math.ceil(math.log(max(seconds, 1e-9) / self.BOUNDS[0], 1.25))))
+        with self.lock:
+            self.counts = [count * self.decay for count in self.counts]
+            self.counts[bucket] += 1.0
+            self.total = self.total * self.decay + 1.0
+            self.samples += 1
+
+    def percentile(self, fraction, min_samples=HEDGE_MIN_SAMPLES):
+        """Upper bound of the bucket holding the given percentile, or None before min_samples samples"""
+        with self.lock:
+            if self.samples < min_samples:
+                return None
+            target = fraction * self.total
+            seen = 0.0
+            for bucket, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return self.BOUNDS[min(bucket, len(self.BOUNDS) - 1)]
+            return self.BOUNDS[-1]
+
+class Endpoint:
+    """One OpenAI-compatible API with its own client, model and latency history"""
+
+    def __init__(self, client, model, name=None):
+        self.client = client
+        self.model = model
+        self.name = name or urlparse(client.base_url).netloc
+        self.latency = LatencyHistogram()  # whole completions
+        self.first_token = LatencyHistogram()  # time to first streamed token
+
+class EndpointRouter:
+    """
+    Sends chat completions to an ordered list of endpoints with hedging and fallback.
+
+    Endpoints are tried in configured order, skipping any whose circuit breaker
+    is open and moving to the back any whose median latency is more than
+    ROUTE_SLOWDOWN_FACTOR times the fastest one's. If the chosen endpoint has
+    not answered (or, when streaming, sent a first token) within its
+    HEDGE_PERCENTILE latency, the same request is sent to the next endpoint and
+    the first answer wins; a failed endpoint is replaced by the next one at once.
+    A small share of requests is led by another endpoint so every latency
+    estimate stays current. Those are hedged to the preferred endpoint on its
+    own schedule, so exploring a slow endpoint costs no more than that delay.
+
+    A losing stream is closed, which drops its connection. A losing plain
+    request cannot be interrupted, so its answer is discarded when it arrives;
+    its latency still feeds the histogram.
+
+    Provides the same methods as MistralAI, so it can stand in for LLMClient.client.
+    """
+
+    def __init__(self, endpoints, hedge=True, max_hedges=1):
+        self.endpoints = endpoints
+        self.hedge = hedge
+        self.max_hedges = max_hedges
+        self.api_key = endpoints[0].client.api_key
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE * len(endpoints))
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def route(self, streaming=False):
+        """Endpoints to try for the next request, in order"""
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.client.breaker.state != "open"]
+        medians = [(endpoint.first_token if streaming else endpoint.latency).percentile(0.5, ROUTE_MIN_SAMPLES)
+                   for endpoint in healthy]
+        known = [median for median in medians if median is not None]
+        fastest = min(known) if known else None
+        preferred, slow = [], []
+        for endpoint, median in zip(healthy, medians):
+            if fastest is not None and median is not None and median > ROUTE_SLOWDOWN_FACTOR * fastest:
+                slow.append((median, endpoint))
+            else:
+                preferred.append(endpoint)
+        return preferred + [endpoint for _, endpoint in sorted(slow, key=lambda item: item[0])]
+
+    def _plan(self, streaming=False):
+        """Endpoints to try for a request, in order, and the delay before hedging the first"""
+        order = self.route(streaming)
+        delay = self.hedge_delay(order[0], streaming) if order else None
+        if len(order) > 1 and random.random() < ROUTE_EXPLORE_FRACTION:
+            # The explored endpoint leads; the preferred one, now second, is the hedge
+            order.insert(0, order.pop(random.randrange(1, len(order))))
+        return order, delay
+
+    def hedge_delay(self, endpoint, streaming=False):
+        """How long to wait for an endpoint before sending a hedged duplicate"""
+        estimate = (endpoint.first_token if streaming else endpoint.latency).percentile(HEDGE_PERCENTILE)
+        return max(HEDGE_MIN_DELAY, estimate if estimate is not None else HEDGE_DEFAULT_DELAY)
+
+    def _attempt(self, endpoint, messages, temperature, max_tokens):
+        started = time.perf_counter()
+        result = endpoint.client.chat_completion(messages, model=endpoint.model, temperature=temperature, max_tokens=max_tokens)
+        if result:
+            endpoint.latency.observe(time.perf_counter() - started)
+        return result
+
+    @metrics.timed("api.routed_completion")
+    def chat_completion(self, messages, model=MODEL_NAME, temperature=0.7, max_tokens=1000):
+        """Return the first successful completion from the routed endpoints, or None if all fail"""
+        order, delay = self._plan()
+        if not order:
+            console.print("[red]Error making API request: every endpoint is unavailable[/red]")
+            return None
+        pending = {}
+        next_index = 0
+        
+        def launch():
+            nonlocal next_index
+            endpoint = order[next_index]
+            next_index += 1
+            pending[self.executor.submit(self._attempt, endpoint, messages, temperature, max_tokens)] = endpoint
+            return endpoint
+        
+        primary = launch()
+        hedge_at = time.monotonic() + delay
+        hedges = 0
+        while pending:
+            can_hedge = self.hedge and hedges < self.max_hedges and next_index < len(order)
+            timeout = max(0.0, hedge_at - time.monotonic()) if can_hedge else None
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                hedges += 1
+                self.hedges += 1
+                metrics.count("api.hedged_requests")
+                launch()
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                result = future.result()
+                if result:
+                    if endpoint is not primary:
+                        self.hedge_wins += 1
+                    for loser in pending:
+                        loser.cancel()
+                    return result
+            if not pending and next_index < len(order):
+                self.fallbacks += 1
+                metrics.count("api.fallbacks")
+                hedge_at = time.monotonic() + self.hedge_delay(launch())
+        return None
+
+    def _stream_attempt(self, endpoint, messages, temperature, max_tokens, events, stop):
+        started = time.perf_counter()
+        received = False
+        try:
+            for delta in endpoint.client.chat_completion_stream(messages, model=endpoint.model, temperature=temperature,
+                                                                max_tokens=max_tokens, cancel=stop):
+                if stop.is_set():
+                    break
+                if not received:
+                    received = True
+                    endpoint.first_token.observe(time.perf_counter() - started)
+                events.put((endpoint, delta))
+        finally:
+            events.put((endpoint, None))
+
+    def chat_completion_stream(self, messages, model=MODEL_NAME, temperature=0.7, max_tokens=1000):
+        """Yield content deltas from whichever routed endpoint sends a first token first"""
+        order, delay = self._plan(streaming=True)
+        if not order:
+            console.print("[red]Error making API request: every endpoint is unavailable[/red]")
+            return
+        events = queue.Queue()
+        active = {}  # endpoint -> StreamCancel of its attempt
+        next_index = 0
+        
+        def launch():
+            nonlocal next_index
+            endpoint = order[next_index]
+            next_index += 1
+            stop = StreamCancel()
+            active[endpoint] = stop
+            self.executor.submit(self._stream_attempt, endpoint, messages, temperature, max_tokens, events, stop)
+            return endpoint
+        
+        primary = launch()
+        hedge_at = time.monotonic() + delay
+        hedges = 0
+        winner = None
+        try:
+            while winner is None and active:
+                can_hedge = self.hedge and hedges < self.max_hedges and next_index < len(order)
+                try:
+                    endpoint, delta = events.get(timeout=max(0.0, hedge_at - time.monotonic()) if can_hedge else None)
+                except queue.Empty:
+                    hedges += 1
+                    self.hedges += 1
+                    metrics.count("api.hedged_requests")
+                    launch()
+                    continue
+                if delta is None:
+                    # Ended without a single token: fall back to the next endpoint
+                    active.pop(endpoint, None)
+                    if not active and next_index < len(order):
+                        self.fallbacks += 1
+                        metrics.count("api.fallbacks")
+                        hedge_at = time.monotonic() + self.hedge_delay(launch(), streaming=True)
+                    continue
+                winner = endpoint
+                if winner is not primary:
+                    self.hedge_wins += 1
+                # Losers are cut off before their first token, so their latency is unknown and not recorded
+                for loser, stop in active.items():
+                    if loser is not winner:
+                        stop.cancel()
+                yield delta
+            
+            while winner is not None:
+                endpoint, delta = events.get()
+                if endpoint is not winner:
+                    continue
+                if delta is None:
+                    active.pop(winner)
+                    break
+                yield delta
+        finally:
+            # Only streams still running are cancelled: a finished one no longer owns its connection
+            for stop in active.values():
+                stop.cancel()
+
+    def list_models(self):
+        for endpoint in self.route():
+            models = endpoint.client.list_models()
+            if models:
+                return models
+        return None
+
+    def connection_stats(self):
+        """Per-endpoint connection reuse and latency percentiles, plus hedging counts"""
+        stats = {"hedges": self.hedges, "hedge_wins": self.hedge_wins, "fallbacks": self.fallbacks}
+        for endpoint in self.endpoints:
+            for name, value in endpoint.client.connection_stats().items():
+                stats[f"{endpoint.name}.{name}"] = value
+            for fraction in (0.5, 0.95):
+                estimate = endpoint.latency.percentile(fraction)
+                if estimate is not None:
+                    stats[f"{endpoint.name}.p{int(fraction * 100)}_ms"] = round(estimate * 1000, 1)
+        return stats
+
+def create_api_client(api_key, pool_size=HTTP_POOL_SIZE):
+    """
+    Return a MistralAI client, or an EndpointRouter when API_ENDPOINTS lists endpoints.
+    Each endpoint entry has a base_url and optionally a model, a name and the
+    environment variable holding its API key (api_key_env; defaults to this key).
+    """
+    if not API_ENDPOINTS:
+        return MistralAI(api_key, pool_size=pool_size)
+    endpoints = []
+    for entry in json.loads(API_ENDPOINTS):
+        # Falling back to another endpoint replaces retrying the same one
+        client = MistralAI(os.getenv(entry['api_key_env'], "") if entry.get('api_key_env') else api_key,
+                           max_retries=0, pool_size=pool_size)
+        client.base_url = entry['base_url'].rstrip('/')
+        endpoints.append(Endpoint(client, entry.get('model', MODEL_NAME), entry.get('name')))
+    return EndpointRouter(endpoints)
+
 # --- File Processing Functions ---
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF files"""
-    try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-            return text
-    except Exception as e:
-        console.print(f"[red]Error reading PDF {file_path}: {str(e)}[/red]")
-        return ""
+# Extractors are generators of (page_number, text) segments so a document never has to be
+# held in memory as one string. page_number is None for formats without pages.
+# They raise on unreadable files; load_knowledge_base collects the errors per file.
+TEXT_BLOCK_SIZE = 64 * 1024  # characters read at a time from plain-text files
+
+def iter_pdf_pages(file_path, start_page=0, end_page=None):
+    """Yield the text of each PDF page, optionally limited to a page range"""
+    import PyPDF2
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        num_pages = len(pdf_reader.pages)
+        for page_number in range(start_page, min(end_page or num_pages, num_pages)):
+            # Pages are separated by a newline so words never run together across pages
+            yield page_number + 1, (pdf_reader.pages[page_number].extract_text() or "") + "\n"
+
+def count_pdf_pages(file_path):
+    """Return the number of pages in a PDF"""
+    import PyPDF2
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def iter_docx_paragraphs(file_path):
+    """Yield the paragraphs of a Word document"""
+    import docx
+    doc = docx.Document(file_path)
+    for paragraph in doc.paragraphs:
+        yield None, paragraph.text + "\n"
+
+def _format_cell(value):
+    """Render a spreadsheet cell compactly; empty cells become None"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time(0):
+        return value.date().isoformat()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    text = str(value).strip()
+    return text or None
+
+def _sheet_records(sheet_name, rows):
+    """
+    Turn raw sheet rows into (sheet_name, row_number, record) tuples.
+    The first non-empty row supplies the column names for every row after it.
+    """
+    headers = None
+    for row_number, row in enumerate(rows, 1):
+        cells = [_format_cell(value) for value in row]
+        if not any(cells):
+            continue
+        if headers is None:
+            headers = [cell or f"Column {i + 1}" for i, cell in enumerate(cells)]
+            continue
+        fields = []
+        for i, cell in enumerate(cells):
+            if cell is not None:
+                header = headers[i] if i < len(headers) else f"Column {i + 1}"
+                fields.append(f"{header}: {cell}")
+        yield sheet_name, row_number, "; ".join(fields)
+
+def iter_spreadsheet_rows(file_path):
+    """
+    Yield (sheet_name, row_number, record) for every data row of a workbook.
+
+    .xlsx files are streamed row by row in openpyxl's read-only mode; other
+    formats are parsed once for all sheets through pandas.
+    """
+    if Path(file_path).suffix.lower() == '.xlsx':
+        import openpyxl
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                yield from _sheet_records(sheet.title, sheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        import pandas as pd
+        sheets = pd.read_excel(file_path, sheet_name=None, header=None)
+        for sheet_name, df in sheets.items():
+            yield from _sheet_records(sheet_name, df.itertuples(index=False, name=None))
+
+def chunk_spreadsheet(file_path, rows_per_chunk=SPREADSHEET_ROWS_PER_CHUNK, max_words=1000):
+    """
+    Group consecutive rows of a sheet into chunks so retrieval returns whole rows.
+    A chunk ends at a sheet boundary, after rows_per_chunk rows or at max_words words.
+    """
+    rows = []
+    words = 0
+    
+    def make_chunk():
+        sheet_name = rows[0][0]
+        lines = [f"Sheet: {sheet_name}"] + [f"Row {row_number}: {record}" for _, row_number, record in rows]
+        return {
+            'content': "\n".join(lines),
+            'source': file_path,
+            'sheet': sheet_name,
+            'row': rows[0][1],
+            'row_end': rows[-1][1],
+        }
+    
+    for row in iter_spreadsheet_rows(file_path):
+        row_words = len(row[2].split())
+        if rows and (row[0] != rows[0][0] or len(rows) >= rows_per_chunk or words + row_words > max_words):
+            yield make_chunk()
+            rows = []
+            words = 0
+        rows.append(row)
+        words += row_words
+    
+    if rows:
+        yield make_chunk()
+
+def iter_txt_blocks(file_path, block_size=TEXT_BLOCK_SIZE):
+    """Yield a text file in fixed-size blocks"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            yield None, block
+
+def iter_text_segments(file_path):
+    """Yield (page_number, text) segments from a supported non-spreadsheet file based on its extension"""
+    file_extension = Path(file_path).suffix.lower()
+    if file_extension == '.pdf':
+        return iter_pdf_pages(file_path)
+    elif file_extension == '.docx':
+        return iter_docx_paragraphs(file_path)
+    elif file_extension in ['.txt', '.md']:
+        return iter_txt_blocks(file_path)
+    return iter(())
+
+def iter_chunks(file_path):
+    """Yield retrieval chunks for a supported file"""
+    if Path(file_path).suffix.lower() in SPREADSHEET_EXTENSIONS:
+        return chunk_spreadsheet(file_path)
+    return chunk_segments(iter_text_segments(file_path), file_path)
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def remove_stale_files(directory, prefix, suffix, keep):
+    """Delete files in directory named prefix...suffix other than keep (skipping any still mapped elsewhere)"""
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix) and name != keep:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directory, name))
+
+# --- Chunk Store ---
+class ChunkStore:
+    """
+    Compact read-only columnar store of knowledge-base chunks.
+
+    Chunk text lives in one contiguous UTF-8 blob, with a lowercased copy in a
+    second blob for retrieval, and an int64 column matrix holds per-chunk
+    offsets, interned source/sheet IDs and page/row metadata. On disk all three
+    are memory-mapped, so opening a store costs almost nothing and text is read
+    through memoryview slices without copying.
+
+    Indexing a store returns a chunk dict ({'content', 'source', ...}), so code
+    written against the old list of dicts keeps working.
+    """
+
+    (TEXT_OFFSET, TEXT_LENGTH, NORM_OFFSET, NORM_LENGTH, SOURCE,
+     PAGE, PAGE_END, START, END, SHEET, ROW, ROW_END) = range(12)
+    NUM_COLUMNS = 12
+    INT_FIELDS = (('page', PAGE), ('page_end', PAGE_END), ('start', START), ('end', END),
+                  ('row', ROW), ('row_end', ROW_END))
+    # A built store never hides chunks; see LayeredChunkStore
+    deleted = frozenset()
+    copies = {}
+
+    def __init__(self, text, normalized, columns, strings, token=None, mmaps=(), directory=None):
+        self.text = memoryview(text)
+        self.normalized_text = memoryview(normalized)
+        self.columns = columns
+        self.strings = strings
+        self.token = token
+        self.directory = directory
+        self._mmaps = list(mmaps)
+
+    @staticmethod
+    def paths(directory, token):
+        prefix = os.path.join(directory, f"chunks-{token}")
+        return prefix + ".text", prefix + ".norm", prefix + ".cols.npy", prefix + ".json"
+
+    @staticmethod
+    def _map_file(path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def open(cls, directory, token):
+        """Memory-map a store written by ChunkStoreBuilder, or return None if it is missing"""
+        import numpy as np
+        if not token:
+            return None
+        text_path, norm_path, columns_path, strings_path = cls.paths(directory, token)
+        try:
+            with open(strings_path, 'r', encoding='utf-8') as f:
+                strings = json.load(f)
+            columns = np.load(columns_path, mmap_mode='r')
+            text = cls._map_file(text_path)
+            normalized = cls._map_file(norm_path)
+        except (OSError, ValueError):
+            return None
+        mmaps = [m for m in (text, normalized) if isinstance(m, mmap.mmap)]
+        return cls(text, normalized, columns, strings, token, mmaps, directory)
+
+    @classmethod
+    def from_documents(cls, documents):
+        """Return documents as a ChunkStore, building an in-memory one from a list of chunk dicts"""
+        if isinstance(documents, (ChunkStore, LayeredChunkStore)):
+            return documents
+        builder = ChunkStoreBuilder()
+        builder.add_chunks(documents)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.columns)
+
+    def live_count(self):
+        return len(self)
+
+    def content_bytes(self, i):
+        """Zero-copy view of a chunk's UTF-8 text"""
+        offset, length = self.columns[i, self.TEXT_OFFSET], self.columns[i, self.TEXT_LENGTH]
+        return self.text[offset:offset + length]
+
+    def content(self, i):
+        return str(self.content_bytes(i), 'utf-8')
+
+    def normalized(self, i):
+        """Lowercased chunk text, precomputed at build time"""
+        offset, length = self.columns[i, self.NORM_OFFSET], self.columns[i, self.NORM_LENGTH]
+        return str(self.normalized_text[offset:offset + length], 'utf-8')
+
+    def source(self, i):
+        return self.strings[self.columns[i, self.SOURCE]]
+
+    def chunk_id(self, i):
+        """Same value as chunk_id(self[i]), hashed straight from the mapped bytes"""
+        digest = hashlib.sha1(self.source(i).encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(self.content_bytes(i))
+        return digest.hexdigest()[:16]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        row = self.columns[i].tolist()
+        chunk = {'content': self.content(i), 'source': self.strings[row[self.SOURCE]]}
+        for name, column in self.INT_FIELDS:
+            if row[column] >= 0:
+                chunk[name] = row[column]
+        if row[self.SHEET] >= 0:
+            chunk['sheet'] = self.strings[row[self.SHEET]]
+        return chunk
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class ChunkStoreBuilder:
+    """
+    Appends chunks to a new ChunkStore, either in memory or streamed to files in
+    `directory` under a fresh token. Stores are never rewritten in place, so a
+    store that is still mapped elsewhere stays valid.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.token = uuid.uuid4().hex[:12] if directory else None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            text_path, norm_path, _, _ = ChunkStore.paths(directory, self.token)
+            self.text_file = open(text_path, 'wb')
+            self.norm_file = open(norm_path, 'wb')
+        else:
+            self.text_file = io.BytesIO()
+            self.norm_file = io.BytesIO()
+        self.columns = array.array('q')
+        self.strings = []
+        self.string_ids = {}
+        self.text_size = 0
+        self.norm_size = 0
+
+    def __len__(self):
+        return len(self.columns) // ChunkStore.NUM_COLUMNS
+
+    def _intern(self, value):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def _append(self, text, normalized, source, ints, sheet):
+        self.text_file.write(text)
+        self.norm_file.write(normalized)
+        page, page_end, start, end, row, row_end = ints
+        self.columns.extend((self.text_size, len(text), self.norm_size, len(normalized), self._intern(source),
+                             page, page_end, start, end,
+                             self._intern(sheet) if sheet is not None else -1, row, row_end))
+        self.text_size += len(text)
+        self.norm_size += len(normalized)
+
+    def add_chunk(self, chunk):
+        content = chunk['content']
+        ints = [chunk.get(name) for name, _ in ChunkStore.INT_FIELDS]
+        self._append(content.encode('utf-8'), content.lower().encode('utf-8'), chunk['source'],
+                     [-1 if value is None else value for value in ints], chunk.get('sheet'))
+
+    def add_chunks(self, chunks):
+        for chunk in chunks:
+            self.add_chunk(chunk)
+
+    def add_store(self, store):
+        """Append every chunk of another store in one bulk copy, keeping their relative order"""
+        import numpy as np
+        string_ids = np.array([self._intern(value) for value in store.strings] or [0], dtype=np.int64)
+        columns = np.array(store.columns, dtype=np.int64).reshape(-1, ChunkStore.NUM_COLUMNS)
+        columns[:, ChunkStore.TEXT_OFFSET] += self.text_size
+        columns[:, ChunkStore.NORM_OFFSET] += self.norm_size
+        columns[:, ChunkStore.SOURCE] = string_ids[columns[:, ChunkStore.SOURCE]]
+        sheets = columns[:, ChunkStore.SHEET]
+        sheets[sheets >= 0] = string_ids[sheets[sheets >= 0]]
+        if store.directory:
+            # Copy the files rather than the mappings, so the copied text never becomes resident
+            text_path, norm_path, _, _ = ChunkStore.paths(store.directory, store.token)
+            for path, target in ((text_path, self.text_file), (norm_path, self.norm_file)):
+                with open(path, 'rb') as source:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+        else:
+            self.text_file.write(store.text)
+            self.norm_file.write(store.normalized_text)
+        self.columns.frombytes(columns.tobytes())
+        self.text_size += len(store.text)
+        self.norm_size += len(store.normalized_text)
+
+    def add_from_store(self, store, first, count):
+        """Copy a range of chunks from another store without decoding their text"""
+        for i in range(first, first + count):
+            row = store.columns[i].tolist()
+            norm_offset, norm_length = row[ChunkStore.NORM_OFFSET], row[ChunkStore.NORM_LENGTH]
+            sheet = store.strings[row[ChunkStore.SHEET]] if row[ChunkStore.SHEET] >= 0 else None
+            self._append(store.content_bytes(i), store.normalized_text[norm_offset:norm_offset + norm_length],
+                         store.strings[row[ChunkStore.SOURCE]],
+                         [row[column] for _, column in ChunkStore.INT_FIELDS], sheet)
+
+    def finish(self):
+        """Finish writing a store built on disk and return its token, without mapping it"""
+        import numpy as np
+        self.text_file.close()
+        self.norm_file.close()
+        _, _, columns_path, strings_path = ChunkStore.paths(self.directory, self.token)
+        np.save(columns_path, np.frombuffer(self.columns, dtype=np.int64).reshape(-1, ChunkStore.NUM_COLUMNS))
+        with open(strings_path, 'w', encoding='utf-8') as f:
+            json.dump(self.strings, f)
+        return self.token
+
+    def build(self):
+        """Finish writing and return the new store (memory-mapped when built on disk)"""
+        import numpy as np
+        if not self.directory:
+            columns = np.frombuffer(self.columns, dtype=np.int64).reshape(-1, ChunkStore.NUM_COLUMNS)
+            return ChunkStore(self.text_file.getvalue(), self.norm_file.getvalue(), columns, self.strings)
+        return ChunkStore.open(self.directory, self.finish())
+
+class LayeredChunkStore:
+    """
+    A ChunkStore with chunks added and hidden after it was built.
+
+    Live updates must not rewrite the (possibly large, memory-mapped) base
+    store, so chunks of new or changed files go into a small in-memory overlay
+    numbered after the base, and chunks of changed or removed files are only
+    marked deleted. Chunk indices never move, which lets retrieval indexes be
+    updated in place.
+
+    Near-duplicate chunks (see ChunkDeduplicator) are hidden the same way;
+    `copies` maps each chunk that was kept to the indices of its hidden copies,
+    whose sources are listed under the kept chunk's 'sources'.
+    """
+
+    def __init__(self, base, overlay, deleted=frozenset(), copies=None):
+        self.base = base
+        self.overlay = overlay
+        self.deleted = frozenset(deleted)
+        self.copies = copies or {}
+        self.token = None
+
+    @classmethod
+    def from_changes(cls, documents, removed_ids, stores):
+        """
+        Return (store, added_ids): documents with removed_ids hidden and the chunks of stores appended.
+        The cost depends on the size of the overlay, never on the base store.
+        """
+        if isinstance(documents, LayeredChunkStore):
+            base, overlay, deleted = documents.base, documents.overlay, documents.deleted
+        else:
+            base, overlay, deleted = documents, None, frozenset()
+        builder = ChunkStoreBuilder()
+        if overlay is not None:
+            builder.add_store(overlay)
+        for new_store in stores:
+            builder.add_store(new_store)
+        store = cls(base, builder.build(), deleted | frozenset(removed_ids), documents.copies)
+        return store, range(len(documents), len(store))
+
+    def _locate(self, i):
+        return (self.base, i) if i < len(self.base) else (self.overlay, i - len(self.base))
+
+    def __len__(self):
+        return len(self.base) + len(self.overlay)
 
-def extract_text_from_docx(file_path):
-    """Extract text from Word documents"""
+    def live_count(self):
+        return len(self) - len(self.deleted)
+
+    def stale_count(self):
+        """Chunks hidden because their file changed or was removed, rather than as copies"""
+        return len(self.deleted) - sum(len(copies) for copies in self.copies.values())
+
+    def content_bytes(self, i):
+        store, i = self._locate(i)
+        return store.content_bytes(i)
+
+    def content(self, i):
+        store, i = self._locate(i)
+        return store.content(i)
+
+    def normalized(self, i):
+        store, i = self._locate(i)
+        return store.normalized(i)
+
+    def source(self, i):
+        store, i = self._locate(i)
+        return store.source(i)
+
+    def chunk_id(self, i):
+        store, i = self._locate(i)
+        return store.chunk_id(i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        copies = self.copies.get(i)
+        store, j = self._locate(i)
+        chunk = store[j]
+        if copies:
+            sources = [chunk['source']]
+            for copy in copies:
+                source = self.source(copy)
+                if source not in sources:
+                    sources.append(source)
+            chunk['sources'] = sources
+        return chunk
+
+    def __iter__(self):
+        for i in range(len(self)):
+            if i not in self.deleted:
+                yield self[i]
+
+# --- Near-Duplicate Detection ---
+class ChunkDeduplicator:
+    """
+    Finds near-duplicate chunks, such as the same document exported as both PDF
+    and DOCX, with MinHash signatures bucketed by locality-sensitive hashing.
+
+    A chunk's DEDUP_SHINGLE_WORDS-word shingles are summarised by
+    DEDUP_PERMUTATIONS minimum hashes; the share of positions where two
+    signatures agree estimates the Jaccard similarity of their shingle sets.
+    Signatures are cut into DEDUP_BANDS bands and only chunks that agree on a
+    whole band are compared, so the cost grows with the corpus rather than with
+    the number of pairs. The first chunk of each group in store order is kept
+    and the rest are hidden in a LayeredChunkStore, which still lists their sources.
+
+    Signatures are cached by chunk ID in the cache folder, like the vectors of
+    VectorRetriever, so a warm start only hashes new chunks.
+    """
+
+    SEED = 0x5EED
+    BLOCK_ROWS = 65536
+
+    def __init__(self, cache_dir=CACHE_DIR, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_PERMUTATIONS,
+                 bands=DEDUP_BANDS, shingle_words=DEDUP_SHINGLE_WORDS):
+        import numpy as np
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_words = shingle_words
+        # Multiply-add-shift hash family: (a * x + b) mod 2**64, keeping the top 32 bits
+        rng = np.random.default_rng(self.SEED)
+        self.a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.word_hashes = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.added = self.signatures
+        self.keys = np.zeros((0, bands), dtype=np.uint64)
+        self.kept = np.zeros(0, dtype=bool)  # chunks that are indexed: neither hidden copies nor removed
+        self.copy_of = {}
+        self.copies = {}
+
+    def signature(self, text):
+        """MinHash signature (uint32 array of num_perm values) of a normalized text's word shingles"""
+        import numpy as np
+        words = text.split() or [""]
+        unseen = set(words).difference(self.word_hashes)
+        for word in unseen:
+            self.word_hashes[word] = zlib.crc32(word.encode('utf-8'))
+        hashes = np.fromiter(map(self.word_hashes.__getitem__, words), dtype=np.uint64, count=len(words))
+        size = min(self.shingle_words, len(hashes))
+        shingles = np.zeros(len(hashes) - size + 1, dtype=np.uint64)
+        for offset in range(size):
+            shingles = shingles * np.uint64(0x100000001B3) + hashes[offset:offset + len(shingles)]
+        shingles = np.unique((shingles ^ (shingles >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+        return ((shingles[:, None] * self.a + self.b) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signatures):
+        import numpy as np
+        bands = np.asarray(signatures, dtype=np.uint64)[:, :self.bands * self.rows].reshape(-1, self.bands, self.rows)
+        keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+        for row in range(self.rows):
+            keys = keys * np.uint64(0x100000001B3) + bands[:, :, row]
+        return keys
+
+    def _signature_of(self, i):
+        return self.signatures[i] if i < len(self.signatures) else self.added[i - len(self.signatures)]
+
+    def _best_match(self, i, candidates):
+        """The candidate most similar to chunk i, if any reaches the threshold"""
+        import numpy as np
+        signature = self._signature_of(i)
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = np.count_nonzero(signature == self._signature_of(candidate)) / self.num_perm
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def _matrix_path(self, token):
+        # Like the vectors, each build writes a fresh file, as the previous one may still be mapped
+        return os.path.join(self.cache_dir, f"minhash-{token}.npy")
+
+    def _load_or_build(self, documents):
+        import numpy as np
+        ids = [documents.chunk_id(i) for i in range(len(documents))]
+        if not self.cache_dir or not ids:
+            return np.array([self.signature(documents.normalized(i)) for i in range(len(documents))]
+                            or np.zeros((0, self.num_perm)), dtype=np.uint32)
+        meta_path = os.path.join(self.cache_dir, "minhash.json")
+        meta = None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('num_perm') != self.num_perm or meta.get('shingle_words') != self.shingle_words \
+                    or not os.path.exists(self._matrix_path(meta.get('token'))):
+                meta = None
+        except (OSError, ValueError):
+            pass
+        if meta and meta['ids'] == ids:
+            return np.load(self._matrix_path(meta['token']), mmap_mode='r')
+        
+        old_rows = {old_id: row for row, old_id in enumerate(meta['ids'])} if meta else {}
+        old_matrix = np.load(self._matrix_path(meta['token']), mmap_mode='r') if meta else None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        token = uuid.uuid4().hex[:12]
+        matrix = np.lib.format.open_memmap(self._matrix_path(token), mode='w+', dtype=np.uint32, shape=(len(ids), self.num_perm))
+        for row, doc_id in enumerate(ids):
+            old_row = old_rows.get(doc_id)
+            matrix[row] = old_matrix[old_row] if old_row is not None else self.signature(documents.normalized(row))
+        matrix.flush()
+        del matrix, old_matrix
+        
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'num_perm': self.num_perm, 'shingle_words': self.shingle_words, 'token': token, 'ids': ids}, f)
+        os.replace(tmp_path, meta_path)
+        remove_stale_files(self.cache_dir, "minhash", ".npy", os.path.basename(self._matrix_path(token)))
+        return np.load(self._matrix_path(token), mmap_mode='r')
+
+    @metrics.timed("ingest.deduplicate")
+    def deduplicate(self, documents):
+        """
+        Find near-duplicates in a freshly loaded ChunkStore.
+
+        Returns:
+            The store itself if nothing was duplicated, else a LayeredChunkStore hiding the copies
+        """
+        import numpy as np
+        self.signatures = self._load_or_build(documents)
+        self.added = self.signatures[:0]
+        self.keys = np.concatenate([self._band_keys(self.signatures[start:start + self.BLOCK_ROWS])
+                                    for start in range(0, len(self.signatures), self.BLOCK_ROWS)]
+                                   or [self.keys[:0]])
+        self.kept = np.ones(len(documents), dtype=bool)
+        self.copy_of, self.copies = {}, {}
+        if not len(documents):
+            return documents
+        
+        # A chunk that shares no band key with any other chunk cannot have a duplicate
+        shared = np.zeros(self.keys.shape, dtype=bool)
+        for band in range(self.bands):
+            _, inverse, counts = np.unique(self.keys[:, band], return_inverse=True, return_counts=True)
+            shared[:, band] = counts[inverse] > 1
+        buckets = [{} for _ in range(self.bands)]  # band key -> kept chunks with that key
+        for i in np.flatnonzero(shared.any(axis=1)).tolist():
+            bands = np.flatnonzero(shared[i]).tolist()
+            keys = self.keys[i].tolist()
+            candidates = {kept for band in bands for kept in buckets[band].get(keys[band], ())}
+            original = self._best_match(i, sorted(candidates))
+            if original is None:
+                for band in bands:
+                    buckets[band].setdefault(keys[band], []).append(i)
+            else:
+                self._hide(i, original)
+        
+        metrics.count("ingest.duplicate_chunks", len(self.copy_of))
+        if not self.copy_of:
+            return documents
+        return LayeredChunkStore(documents, ChunkStore.from_documents([]), self.copy_of.keys(), self._frozen_copies())
+
+    def _hide(self, i, original):
+        self.kept[i] = False
+        self.copy_of[i] = original
+        self.copies.setdefault(original, []).append(i)
+
+    def _frozen_copies(self):
+        return {original: tuple(copies) for original, copies in self.copies.items()}
+
+    def apply_delta(self, documents, removed_ids, added_ids):
+        """
+        Deduplicate the chunks of a live update (see LayeredChunkStore.from_changes).
+
+        Added chunks that duplicate a kept chunk are hidden. When a kept chunk is
+        removed, its first remaining copy takes its place.
+
+        Returns:
+            tuple: (documents, removed_ids, added_ids) as the retriever should see them:
+            the store with new copies hidden, the chunks that left the index and
+            the chunks that joined it, including promoted copies
+        """
+        import numpy as np
+        index_removed = [i for i in removed_ids if self.kept[i]]
+        removed = set(removed_ids)
+        promoted = []
+        for i in removed_ids:
+            original = self.copy_of.pop(i, None)
+            if original is not None and original not in removed:
+                self.copies[original].remove(i)
+        for i in index_removed:
+            survivors = [copy for copy in self.copies.pop(i, ()) if copy not in removed]
+            if survivors:
+                promoted.append(survivors[0])
+                self.kept[survivors[0]] = True
+                del self.copy_of[survivors[0]]
+                for copy in survivors[1:]:
+                    self._hide(copy, survivors[0])
+        self.copies = {original: copies for original, copies in self.copies.items() if copies}
+        self.kept[list(removed_ids)] = False
+        
+        added_ids = list(added_ids)
+        if added_ids:
+            signatures = np.array([self.signature(documents.normalized(i)) for i in added_ids], dtype=np.uint32)
+            self.added = np.concatenate([self.added, signatures])
+            self.keys = np.concatenate([self.keys, self._band_keys(signatures)])
+            self.kept = np.concatenate([self.kept, np.zeros(len(added_ids), dtype=bool)])
+        hidden = []
+        for i in added_ids:
+            candidates = np.flatnonzero((self.keys == self.keys[i]).any(axis=1) & self.kept).tolist()
+            original = self._best_match(i, candidates)
+            if original is None:
+                self.kept[i] = True
+            else:
+                self._hide(i, original)
+                hidden.append(i)
+        
+        documents = LayeredChunkStore(documents.base, documents.overlay,
+                                      (documents.deleted | frozenset(hidden)) - frozenset(promoted), self._frozen_copies())
+        hidden = set(hidden)
+        return documents, index_removed, [i for i in added_ids if i not in hidden] + promoted
+
+# --- Knowledge Base Cache ---
+class KnowledgeBaseCache:
+    """
+    On-disk store of pre-chunked documents.
+
+    The manifest maps each file path to its size, mtime and content hash and to
+    the range of its chunks in the current ChunkStore, so unchanged files never
+    go through extraction again and a warm start only memory-maps the store.
+    """
+
+    VERSION = 4
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.files = {}
+        self.store = None
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('version') != self.VERSION:
+            return
+        self.store = ChunkStore.open(self.cache_dir, manifest.get('store'))
+        # Chunk ranges are meaningless without the store they point into
+        if self.store is not None:
+            self.files = manifest.get('files', {})
+
+    def lookup(self, file_path, stat):
+        """
+        Return True if the cached chunks for a file are still valid.
+
+        Size and mtime are checked first; the content hash is only computed when
+        they differ, so a touched-but-unchanged file is still a cache hit.
+        """
+        entry = self.files.get(file_path)
+        if entry is None:
+            return False
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if entry['size'] == stat.st_size and entry['hash'] == hash_file(file_path):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.dirty = True
+            return True
+        return False
+
+    def chunk_range(self, file_path):
+        """(first, count) of a cached file's chunks in the current store"""
+        entry = self.files[file_path]
+        return entry['first'], entry['count']
+
+    def update(self, file_path, stat, first, count):
+        """Record where a file's chunks live in the store being built"""
+        entry = self.files.get(file_path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': hash_file(file_path)}
+        entry['first'] = first
+        entry['count'] = count
+        # Rebuild the dict in store order so it lines up with the new store
+        self.files.pop(file_path, None)
+        self.files[file_path] = entry
+        self.dirty = True
+
+    def keep_only(self, paths):
+        """Drop entries for files that were deleted or could not be read"""
+        removed = [path for path in self.files if path not in paths]
+        for path in removed:
+            del self.files[path]
+        if removed:
+            self.dirty = True
+        return removed
+
+    def save(self, store=None):
+        """Atomically write the manifest if anything changed, pointing it at `store`"""
+        if store is not None and store is not self.store:
+            self.store = store
+            self.dirty = True
+        if not self.dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'store': self.store.token if self.store else None, 'files': self.files}, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.dirty = False
+        self.remove_stale_stores()
+
+    def remove_stale_stores(self):
+        """Delete chunk store files left by earlier builds (skipping any still mapped elsewhere)"""
+        current = f"chunks-{self.store.token}." if self.store else None
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("chunks-") and not (current and name.startswith(current)):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+# --- Parallel Ingestion ---
+def _ingest_file(file_path, directory):
+    """Pool worker: stream a whole file's chunks into a store in directory. Returns (token, error)."""
     try:
-        doc = docx.Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        builder = ChunkStoreBuilder(directory)
+        builder.add_chunks(iter_chunks(file_path))
+        return builder.finish(), None
     except Exception as e:
-        console.print(f"[red]Error reading DOCX {file_path}: {str(e)}[/red]")
-        return ""
+        return None, f"{type(e).__name__}: {e}"
 
-def extract_text_from_excel(file_path):
-    """Extract text from Excel files"""
+def _extract_pdf_range(file_path, start_page, end_page, directory):
+    """Pool worker: write one page range of a large PDF to a JSON lines file in directory. Returns (path, error)."""
     try:
-        # Read all sheets
-        excel_file = pd.ExcelFile(file_path)
-        text = ""
-        for sheet_name in excel_file.sheet_names:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            text += f"Sheet: {sheet_name}\n"
-            text += df.to_string() + "\n\n"
-        return text
+        path = os.path.join(directory, f"pages-{uuid.uuid4().hex[:12]}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for page, text in iter_pdf_pages(file_path, start_page, end_page):
+                f.write(json.dumps([page, text]) + "\n")
+        return path, None
     except Exception as e:
-        console.print(f"[red]Error reading Excel {file_path}: {str(e)}[/red]")
-        return ""
+        return None, f"{type(e).__name__}: {e}"
 
-def extract_text_from_txt(file_path):
-    """Extract text from text files"""
+def _read_segments(paths):
+    """Stream (page, text) segments back from the files written by _extract_pdf_range, in order"""
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                page, text = json.loads(line)
+                yield page, text
+
+def _count_pdf_pages(file_path):
+    """Pool worker: count the pages of a PDF. Returns (count, error)."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        return count_pdf_pages(file_path), None
     except Exception as e:
-        console.print(f"[red]Error reading TXT {file_path}: {str(e)}[/red]")
-        return ""
+        return None, f"{type(e).__name__}: {e}"
 
-def load_knowledge_base():
-    """Load all documents from the knowledge folder"""
-    knowledge_folder = "knowledge"
-    if not os.path.exists(knowledge_folder):
-        console.print(Panel("[yellow]Knowledge folder not found[/yellow]", border_style="yellow"))
-        return []
+def _plan_pdf_ranges(file_paths, workers, file_timeout):
+    """
+    Map each PDF in file_paths larger than LARGE_PDF_BYTES to the page ranges it is split into.
+
+    Counting pages parses the PDF, which can hang on exactly the files splitting
+    guards against, so it runs in a pool within file_timeout. A PDF that could
+    not be counted in time, or at all, is extracted as a single job.
+    """
+    large = [path for path in file_paths
+             if path.lower().endswith('.pdf') and os.path.getsize(path) >= LARGE_PDF_BYTES]
+    ranges = {}
+    if not large:
+        return ranges
+    with multiprocessing.Pool(min(workers, len(large))) as pool:
+        tasks = [(path, pool.apply_async(_count_pdf_pages, (path,))) for path in large]
+        deadline = time.monotonic() + file_timeout
+        for path, task in tasks:
+            try:
+                num_pages, _ = task.get(timeout=max(0.0, deadline - time.monotonic()))
+            except multiprocessing.TimeoutError:
+                continue
+            if num_pages and num_pages > PDF_PAGES_PER_TASK:
+                ranges[path] = [(start, min(start + PDF_PAGES_PER_TASK, num_pages))
+                                for start in range(0, num_pages, PDF_PAGES_PER_TASK)]
+    return ranges
+
+def ingest_files(file_paths, directory, workers=None, file_timeout=INGEST_FILE_TIMEOUT):
+    """
+    Extract and chunk files across a process pool.
+
+    Returns (stores_by_path, errors). Each file that was read gets a ChunkStore
+    of its chunks, written to `directory` by the worker as they are produced and
+    memory-mapped here, so no file's chunks are ever held in memory as a list;
+    copy them out before the directory is removed. errors maps a file path to a
+    message.
+    Results are gathered in submission order, so output is deterministic, and a
+    file that exceeds file_timeout is reported as an error instead of blocking.
+    Even a single file goes through the pool, since only a worker process can be
+    killed when it hangs.
+    """
+    stores_by_path = {}
+    errors = {}
+    if not file_paths:
+        return stores_by_path, errors
     
-    documents = []
-    supported_extensions = ['.pdf', '.docx', '.xlsx', '.xls', '.txt', '.md']
+    workers = workers or INGEST_WORKERS or os.cpu_count() or 1
+    page_ranges = _plan_pdf_ranges(file_paths, workers, file_timeout)
+    plans = [(file_path, page_ranges.get(file_path)) for file_path in file_paths]
+    while plans:
+        num_tasks = sum(len(page_ranges) if page_ranges else 1 for _, page_ranges in plans)
+        # Leaving the with-block terminates the pool, killing any worker stuck on a timed-out file
+        with multiprocessing.Pool(min(workers, num_tasks)) as pool:
+            pending = []
+            for file_path, page_ranges in plans:
+                if page_ranges:
+                    tasks = [pool.apply_async(_extract_pdf_range, (file_path, start, end, directory))
+                             for start, end in page_ranges]
+                else:
+                    tasks = [pool.apply_async(_ingest_file, (file_path, directory))]
+                pending.append((file_path, page_ranges, tasks))
+            plans = []
+            
+            for position, (file_path, page_ranges, tasks) in enumerate(pending):
+                deadline = time.monotonic() + file_timeout
+                try:
+                    results = [task.get(timeout=max(0.0, deadline - time.monotonic())) for task in tasks]
+                except multiprocessing.TimeoutError:
+                    errors[file_path] = f"Timed out after {file_timeout}s"
+                    # The stuck worker would hold up the files queued behind it, so they get a fresh pool
+                    plans = [(path, ranges) for path, ranges, _ in pending[position + 1:]]
+                    break
+                
+                failures = [error for _, error in results if error]
+                if failures:
+                    errors[file_path] = failures[0]
+                elif page_ranges:
+                    # Chunks may span page ranges, so the ranges are chunked here, in order
+                    builder = ChunkStoreBuilder(directory)
+                    builder.add_chunks(chunk_segments(_read_segments([path for path, _ in results]), file_path))
+                    stores_by_path[file_path] = builder.build()
+                else:
+                    stores_by_path[file_path] = ChunkStore.open(directory, results[0][0])
     
-    # Find all files in knowledge folder
-    files_processed = 0
+    return stores_by_path, errors
+
+def scan_knowledge_folder(knowledge_folder=KNOWLEDGE_FOLDER):
+    """Return {file path: os.stat result} for every supported file, in a stable order"""
+    stats = {}
     for root, dirs, files in os.walk(knowledge_folder):
-        for file in files:
+        dirs.sort()
+        for file in sorted(files):
             file_path = os.path.join(root, file)
-            file_extension = Path(file_path).suffix.lower()
+            if Path(file_path).suffix.lower() in SUPPORTED_EXTENSIONS:
+                try:
+                    stats[file_path] = os.stat(file_path)
+                except OSError:
+                    # Removed between listing and stat
+                    pass
+    return stats
+
+@metrics.timed("ingest.total")
+def load_knowledge_base(knowledge_folder=KNOWLEDGE_FOLDER, use_cache=True, workers=None, report=None, cache=None,
+                        deduplicator=None):
+    """
+    Load all documents from the knowledge folder into a ChunkStore.
+
+    Files whose size, mtime and content hash match the on-disk cache reuse their
+    stored chunks; only new or changed files are extracted and chunked again,
+    in parallel across `workers` processes. If nothing changed, the cached store
+    is memory-mapped and returned as is.
+
+    Status messages are printed, or appended to `report` when loading runs in the
+    background and must not interleave with the user's typing. Pass a
+    KnowledgeBaseCache as `cache` to keep its file list, which afterwards
+    describes the chunk ranges of the returned store.
+
+    Near-duplicate chunks are hidden unless DEDUP_THRESHOLD is 0. Pass a
+    ChunkDeduplicator as `deduplicator` to keep its signatures for live updates.
+    """
+    show = report.append if report is not None else console.print
+    if not os.path.exists(knowledge_folder):
+        show(Panel("[yellow]Knowledge folder not found[/yellow]", border_style="yellow"))
+        if cache:
+            cache.files = {}
+        return ChunkStore.from_documents([])
+    
+    if cache is None and use_cache:
+        cache = KnowledgeBaseCache()
+    
+    # Find all files in knowledge folder
+    stats = scan_knowledge_folder(knowledge_folder)
+    file_paths = list(stats)
+    cached_paths = {path for path in file_paths if cache and cache.lookup(path, stats[path])}
+    
+    to_process = [path for path in file_paths if path not in cached_paths]
+    if to_process and report is None:
+        console.print(f"[blue]Processing {len(to_process)} files...[/blue]")
+    cache_dir = cache.cache_dir if cache else None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    # Workers write the chunks of each file to a store in here, which is copied into the new store
+    scratch_dir = tempfile.TemporaryDirectory(prefix="ingest-", dir=cache_dir) if to_process else contextlib.nullcontext()
+    with scratch_dir as scratch:
+        with metrics.span("ingest.extract", files=len(to_process)):
+            new_stores, errors = ingest_files(to_process, scratch, workers=workers)
+        metrics.count("ingest.files_extracted", len(to_process))
+        metrics.count("ingest.files_cached", len(cached_paths))
+        
+        if cache and cache.store is not None and not to_process and list(cache.files) == file_paths:
+            # Nothing was added, changed or removed: reuse the mapped store
+            documents = cache.store
+            files_processed = sum(1 for entry in cache.files.values() if entry['count'])
+            cache.save()
+        else:
+            builder = ChunkStoreBuilder(cache_dir)
+            files_processed = 0
+            for file_path in file_paths:
+                first = len(builder)
+                if file_path in cached_paths:
+                    builder.add_from_store(cache.store, *cache.chunk_range(file_path))
+                elif file_path in new_stores:
+                    builder.add_store(new_stores[file_path])
+                count = len(builder) - first
+                # Failed files are not cached so they are retried on the next load
+                if cache and file_path not in errors:
+                    cache.update(file_path, stats[file_path], first, count)
+                if count:
+                    files_processed += 1
+            documents = builder.build()
+            if cache:
+                cache.keep_only(set(file_paths) - set(errors))
+                cache.save(documents)
+    
+    if errors:
+        error_lines = "\n".join(f"{path}: {error}" for path, error in errors.items())
+        show(Panel(f"[red]{error_lines}[/red]", title="[bold red]Files that could not be read[/bold red]", border_style="red"))
+    show(Panel(f"[green]Successfully processed {files_processed} files ({len(cached_paths)} from cache)[/green]", border_style="green"))
+    
+    if deduplicator is None and DEDUP_THRESHOLD > 0:
+        deduplicator = ChunkDeduplicator(cache.cache_dir if cache else None)
+    if deduplicator and len(documents):
+        total = len(documents)
+        documents = deduplicator.deduplicate(documents)
+        duplicates = total - documents.live_count()
+        if duplicates:
+            show(Panel(f"[green]Merged {duplicates} near-duplicate chunks: {total} -> {total - duplicates} "
+                       f"({duplicates / total:.0%} smaller)[/green]", border_style="green"))
+    return documents
+
+WORD_PATTERN = re.compile(r"\S+")
+
+def iter_words(segments):
+    """
+    Yield (word, page_number, start, end) for every whitespace-separated word in a
+    stream of (page_number, text) segments. Offsets are character positions in the
+    concatenated stream, and words cut at a segment boundary are rejoined.
+    """
+    offset = 0
+    pending = None  # word that touched the end of the previous segment
+    for page, text in segments:
+        if not text:
+            continue
+        if pending and text[0].isspace():
+            yield pending
+            pending = None
+        for match in WORD_PATTERN.finditer(text):
+            word, word_page, start = match.group(), page, offset + match.start()
+            if pending:
+                word, word_page, start = pending[0] + word, pending[1], pending[2]
+                pending = None
+            if match.end() == len(text):
+                pending = (word, word_page, start, offset + match.end())
+            else:
+                yield word, word_page, start, offset + match.end()
+        offset += len(text)
+    if pending:
+        yield pending
+
+def _make_chunk(window, source_file):
+    chunk_text = ' '.join(word for word, _, _, _ in window)
+    # Skip very short chunks
+    if len(chunk_text.strip()) <= 50:
+        return None
+    first, last = window[0], window[-1]
+    return {
+        'content': chunk_text,
+        'source': source_file,
+        'page': first[1],
+        'page_end': last[1],
+        'start': first[2],
+        'end': last[3],
+    }
+
+def chunk_segments(segments, source_file, chunk_size=1000, overlap=100):
+    """
+    Split a stream of (page_number, text) segments into overlapping word chunks.
+
+    Only a sliding window of chunk_size words is kept in memory, so peak memory
+    does not depend on document size. Each chunk records the pages it spans and
+    its character offsets in the extracted text.
+    """
+    step = chunk_size - overlap
+    window = deque()
+    unemitted = 0  # words in the window not yet part of any chunk
+    for word in iter_words(segments):
+        window.append(word)
+        unemitted += 1
+        if len(window) == chunk_size:
+            chunk = _make_chunk(window, source_file)
+            if chunk:
+                yield chunk
+            for _ in range(step):
+                window.popleft()
+            unemitted = 0
+    
+    if unemitted:
+        chunk = _make_chunk(window, source_file)
+        if chunk:
+            yield chunk
+
+def split_text_into_chunks(text, source_file, chunk_size=1000, overlap=100):
+    """Split text into smaller chunks for better retrieval"""
+    return list(chunk_segments([(None, text)], source_file, chunk_size, overlap))
+
+# --- Retrieval ---
+def _combining_marks(start=0x0300, end=0x0E00):
+    """Character class body for the combining marks from Latin accents through the Indic scripts"""
+    runs = []
+    for code in range(start, end):
+        if unicodedata.category(chr(code)).startswith('M'):
+            if runs and runs[-1][1] == code - 1:
+                runs[-1][1] = code
+            else:
+                runs.append([code, code])
+    return "".join(chr(first) if first == last else f"{chr(first)}-{chr(last)}" for first, last in runs)
+
+# Chinese and Japanese are written without spaces, so each ideograph or kana is its own term
+CJK_CHARACTERS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+# Letters and digits of any script; vowel signs and other marks stay inside their word
+TOKEN_PATTERN = re.compile(rf"[{CJK_CHARACTERS}]|(?:[^\W_{CJK_CHARACTERS}]+[{_combining_marks()}]*)+")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before
+being below between both but by can could did do does doing down during each few for
+from further had has have having he her here hers herself him himself his how i if in
+into is it its itself just me more most my myself no nor not now of off on once only or
+other our ours ourselves out over own same she should so some such than that the their
+theirs them themselves then there these they this those through to too under until up
+very was we were what when where which while who whom why will with would you your
+yours yourself yourselves tell please
+""".split())
+
+def tokenize(text, normalized=False):
+    """Lowercase (unless already normalized), split into alphanumeric terms and drop stopwords"""
+    if not normalized:
+        text = text.lower()
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS]
+
+def format_context(chunks):
+    """Format retrieved chunks with their source information"""
+    context_parts = []
+    for chunk in chunks:
+        source = chunk['source']
+        if chunk.get('page'):
+            pages = chunk['page'] if chunk['page'] == chunk.get('page_end', chunk['page']) else f"{chunk['page']}-{chunk['page_end']}"
+            source = f"{source} (page {pages})"
+        elif chunk.get('sheet'):
+            source = f"{source} (sheet {chunk['sheet']}, rows {chunk['row']}-{chunk['row_end']})"
+        if len(chunk.get('sources', ())) > 1:
+            # Near-duplicate copies of this text were merged at ingest
+            source = f"{source} (also in {', '.join(chunk['sources'][1:])})"
+        context_parts.append(f"Source: {source}\nContent: {chunk['content']}")
+    
+    return "\n\n---\n\n".join(context_parts) if context_parts else "No relevant context found."
+
+def chunk_id(chunk):
+    """Stable content-derived identifier for a knowledge-base chunk"""
+    return hashlib.sha1(f"{chunk['source']}\0{chunk['content']}".encode('utf-8')).hexdigest()[:16]
+
+class BM25Retriever:
+    """
+    Okapi BM25 ranking over an inverted index built once at ingest time.
+
+    Queries only touch the posting lists of their own terms, so lookup cost
+    depends on how common the query terms are rather than on corpus size.
+    Document frequencies and lengths are kept as running totals, so chunks can
+    be added and removed without rebuilding the index; removed chunks stay in
+    the posting lists and are skipped at query time.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = ChunkStore.from_documents(documents)
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_freq = Counter()
+        self.doc_lengths = [0] * len(self.documents)
+        self.deleted = set()
+        self.num_docs = 0
+        self.total_length = 0
+        self._add(doc_id for doc_id in range(len(self.documents)) if doc_id not in self.documents.deleted)
+
+    def _add(self, doc_ids):
+        for doc_id in doc_ids:
+            term_counts = Counter(tokenize(self.documents.normalized(doc_id), normalized=True))
+            length = sum(term_counts.values())
+            self.doc_lengths[doc_id] = length
+            self.total_length += length
+            self.num_docs += 1
+            self.doc_freq.update(term_counts.keys())
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, []).append((doc_id, count))
+
+    def _remove(self, doc_ids):
+        for doc_id in doc_ids:
+            if doc_id in self.deleted:
+                continue
+            self.doc_freq.subtract(set(tokenize(self.documents.normalized(doc_id), normalized=True)))
+            self.total_length -= self.doc_lengths[doc_id]
+            self.num_docs -= 1
+            self.deleted.add(doc_id)
+
+    def apply_delta(self, documents, removed_ids, added_ids):
+        """Switch to documents, dropping removed_ids and indexing added_ids (appended or formerly hidden chunks)"""
+        self._remove(removed_ids)
+        self.documents = documents
+        self.doc_lengths.extend([0] * (len(documents) - len(self.doc_lengths)))
+        self._add(added_ids)
+
+    def idf(self, term):
+        doc_freq = self.doc_freq[term]
+        return math.log(1 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def search_ids(self, question, max_chunks=3):
+        """Return up to max_chunks (score, chunk index) pairs, best first"""
+        if not self.documents:
+            return []
+        
+        scores = {}
+        k1, b = self.k1, self.b
+        avg_doc_length = (self.total_length / self.num_docs if self.num_docs else 0.0) or 1.0
+        deleted = self.deleted
+        for term in set(tokenize(question)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in posting:
+                if deleted and doc_id in deleted:
+                    continue
+                norm = k1 * (1 - b + b * self.doc_lengths[doc_id] / avg_doc_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        
+        top = heapq.nlargest(max_chunks, scores.items(), key=lambda item: item[1])
+        return [(score, doc_id) for doc_id, score in top]
+
+    def search(self, question, max_chunks=3):
+        """Return up to max_chunks (score, document) pairs, best first"""
+        return [(score, self.documents[doc_id]) for score, doc_id in self.search_ids(question, max_chunks)]
+
+class HashedEmbedder:
+    """
+    Offline text embeddings from hashed word and character n-gram features.
+
+    Each term maps to a fixed signed random-like vector built from its word and
+    character 4-gram hashes, so related word forms ("founded", "founding") share
+    dimensions. A text vector is the sublinear-tf weighted sum of its term
+    vectors, L2-normalised. No model, network or GPU is needed.
+    """
+
+    VERSION = 2  # Bumped whenever tokenization changes, so cached vectors are rebuilt
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.term_vectors = {}
+
+    def _term_vector(self, term):
+        import numpy as np
+        vector = self.term_vectors.get(term)
+        if vector is None:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            padded = f"#{term}#"
+            features = [term] + [padded[i:i + 4] for i in range(max(1, len(padded) - 3))]
+            for feature in features:
+                digest = zlib.crc32(feature.encode('utf-8'))
+                vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+            self.term_vectors[term] = vector
+        return vector
+
+    def embed(self, text):
+        """Return a unit-length float32 vector for text (all zeros if it has no terms)"""
+        import numpy as np
+        term_counts = Counter(tokenize(text))
+        if not term_counts:
+            return np.zeros(self.dim, dtype=np.float32)
+        weights = np.array([1.0 + math.log(count) for count in term_counts.values()], dtype=np.float32)
+        vector = weights @ np.stack([self._term_vector(term) for term in term_counts])
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class VectorRetriever:
+    """
+    Dense retrieval over an embedding matrix stored as a memory-mapped .npy file.
+
+    The matrix lives in the cache folder next to the list of chunk IDs it was
+    built from. On load, rows for unchanged chunks are copied from the previous
+    file and only new chunks are embedded; if nothing changed the file is mapped
+    read-only straight away. Like a ChunkStore, a matrix file is never rewritten:
+    each build writes a new one, since a retriever still in use may map the old. Searches score the matrix block by block, so only
+    one block of vectors has to be resident at a time. Live updates embed only
+    the added chunks into a small in-memory matrix and mask removed rows.
+    """
+
+    BLOCK_ROWS = 65536
+
+    def __init__(self, documents, cache_dir=CACHE_DIR, embedder=None):
+        self.documents = ChunkStore.from_documents(documents)
+        self.embedder = embedder or HashedEmbedder()
+        self.cache_dir = cache_dir
+        self.meta_path = os.path.join(cache_dir, "vectors.json")
+        self.matrix = self._load_or_build([self.documents.chunk_id(i) for i in range(len(self.documents))])
+        self.added = self.matrix[:0]
+        self.alive = None
+        if self.documents.deleted:
+            self._mask(self.documents.deleted)
+
+    def _mask(self, doc_ids):
+        import numpy as np
+        size = len(self.matrix) + len(self.added)
+        if self.alive is None:
+            self.alive = np.ones(size, dtype=bool)
+        elif len(self.alive) < size:
+            self.alive = np.concatenate([self.alive, np.ones(size - len(self.alive), dtype=bool)])
+        self.alive[list(doc_ids)] = False
+
+    def apply_delta(self, documents, removed_ids, added_ids):
+        """Switch to documents, masking removed_ids and unmasking added_ids (appended or formerly hidden chunks)"""
+        import numpy as np
+        known = len(self.matrix) + len(self.added)
+        if len(documents) > known:
+            # Rows must line up with chunk indices, so hidden new chunks are embedded too and masked
+            vectors = np.stack([self.embedder.embed(documents.content(i)) for i in range(known, len(documents))])
+            self.added = np.concatenate([self.added, vectors])
+        self.documents = documents
+        hidden = set(range(known, len(documents))).difference(added_ids)
+        if removed_ids or hidden or self.alive is not None:
+            self._mask(list(removed_ids) + sorted(hidden))
+            self.alive[[i for i in added_ids if i < known]] = True
+
+    def _matrix_path(self, token):
+        return os.path.join(self.cache_dir, f"vectors-{token}.npy")
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('dim') == self.embedder.dim and meta.get('version') == self.embedder.VERSION \
+                    and os.path.exists(self._matrix_path(meta.get('token'))):
+                return meta
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _load_or_build(self, ids):
+        import numpy as np
+        if not ids:
+            return np.zeros((0, self.embedder.dim), dtype=np.float32)
+        meta = self._read_meta()
+        if meta and meta['ids'] == ids:
+            return np.load(self._matrix_path(meta['token']), mmap_mode='r')
+        
+        old_rows = {}
+        old_matrix = None
+        if meta:
+            old_rows = {old_id: row for row, old_id in enumerate(meta['ids'])}
+            old_matrix = np.load(self._matrix_path(meta['token']), mmap_mode='r')
+        
+        os.makedirs(self.cache_dir or ".", exist_ok=True)
+        token = uuid.uuid4().hex[:12]
+        matrix_path = self._matrix_path(token)
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(len(ids), self.embedder.dim))
+        for row, doc_id in enumerate(ids):
+            old_row = old_rows.get(doc_id)
+            matrix[row] = old_matrix[old_row] if old_row is not None else self.embedder.embed(self.documents.content(row))
+        matrix.flush()
+        del matrix, old_matrix
+        
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.embedder.dim, 'version': self.embedder.VERSION, 'token': token, 'ids': ids}, f)
+        os.replace(tmp_path, self.meta_path)
+        remove_stale_files(self.cache_dir or ".", "vectors", ".npy", os.path.basename(matrix_path))
+        return np.load(matrix_path, mmap_mode='r')
+
+    def search_ids(self, question, max_chunks=3):
+        """Return up to max_chunks (cosine similarity, chunk index) pairs, best first"""
+        import numpy as np
+        if not self.documents:
+            return []
+        query = self.embedder.embed(question)
+        if not query.any():
+            return []
+        
+        candidates = []
+        for offset, matrix in ((0, self.matrix), (len(self.matrix), self.added)):
+            for start in range(0, len(matrix), self.BLOCK_ROWS):
+                scores = matrix[start:start + self.BLOCK_ROWS] @ query
+                first = offset + start
+                if self.alive is not None:
+                    scores[~self.alive[first:first + len(scores)]] = -np.inf
+                k = min(max_chunks, len(scores))
+                top = np.argpartition(-scores, k - 1)[:k]
+                candidates.extend((float(scores[i]), first + int(i)) for i in top if scores[i] > 0)
+        
+        return heapq.nlargest(max_chunks, candidates)
+
+    def search(self, question, max_chunks=3):
+        """Return up to max_chunks (cosine similarity, document) pairs, best first"""
+        return [(score, self.documents[doc_id]) for score, doc_id in self.search_ids(question, max_chunks)]
+
+class HybridRetriever:
+    """
+    Fuses keyword (BM25) and dense rankings with reciprocal rank fusion, so a
+    chunk ranked well by either method can reach the top.
+    """
+
+    def __init__(self, documents, rrf_k=60, candidates=20):
+        self.documents = ChunkStore.from_documents(documents)
+        self.keyword = BM25Retriever(self.documents)
+        self.vector = VectorRetriever(self.documents)
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+
+    def apply_delta(self, documents, removed_ids, added_ids):
+        """Apply the same chunk changes to both underlying indexes"""
+        self.keyword.apply_delta(documents, removed_ids, added_ids)
+        self.vector.apply_delta(documents, removed_ids, added_ids)
+        self.documents = documents
+
+    def search_ids(self, question, max_chunks=3):
+        """Return up to max_chunks (fused score, chunk index) pairs, best first"""
+        fused = {}
+        for retriever in (self.keyword, self.vector):
+            for rank, (_, doc_id) in enumerate(retriever.search_ids(question, max(self.candidates, max_chunks))):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        
+        top = heapq.nlargest(max_chunks, fused.items(), key=lambda item: item[1])
+        return [(score, doc_id) for doc_id, score in top]
+
+    def search(self, question, max_chunks=3):
+        """Return up to max_chunks (fused score, document) pairs, best first"""
+        return [(score, self.documents[doc_id]) for score, doc_id in self.search_ids(question, max_chunks)]
+
+RETRIEVERS = {
+    "bm25": BM25Retriever,
+    "vector": VectorRetriever,
+    "hybrid": HybridRetriever,
+}
+
+def build_retriever(documents, mode=None):
+    """Create the retriever selected by RETRIEVAL_MODE (bm25, vector or hybrid)"""
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVERS:
+        console.print(f"[yellow]Unknown retrieval mode '{mode}', using bm25[/yellow]")
+        mode = "bm25"
+    return RETRIEVERS[mode](documents)
+
+def get_relevant_context(documents, question, max_chunks=CONTEXT_CANDIDATES, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Rank documents for a question with BM25 and pack the best passages into token_budget.
+    Builds a throwaway index; long-lived callers should keep a BM25Retriever instead.
+    """
+    if not documents:
+        return ""
+    
+    chunks = [doc for _, doc in BM25Retriever(documents).search(question, max_chunks)]
+    return format_context(pack_context(question, chunks, token_budget))
+
+# --- Context Packing ---
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def split_passage_units(chunk, max_words=SNIPPET_WORDS):
+    """
+    Split a chunk into sentences (rows for spreadsheet chunks), cutting any
+    longer than max_words words into pieces.
+    """
+    pieces = chunk['content'].split("\n") if chunk.get('sheet') else SENTENCE_PATTERN.split(chunk['content'])
+    units = []
+    for piece in pieces:
+        words = piece.split()
+        for start in range(0, len(words), max_words):
+            units.append(words[start:start + max_words])
+    return units
+
+def _expand_window(unit_sizes, seed, max_words):
+    """Grow a run of units around seed, alternating after/before, while it stays within max_words"""
+    first = last = seed
+    size = unit_sizes[seed]
+    grown = True
+    while grown:
+        grown = False
+        if last + 1 < len(unit_sizes) and size + unit_sizes[last + 1] <= max_words:
+            last += 1
+            size += unit_sizes[last]
+            grown = True
+        if first > 0 and size + unit_sizes[first - 1] <= max_words:
+            first -= 1
+            size += unit_sizes[first]
+            grown = True
+    return first, last
+
+def _word_shingles(words, size=3):
+    words = [word.lower() for word in words]
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _shingle_similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _trim_passage(candidate, token_budget, weights):
+    """
+    Cut a candidate passage down to the words that fit in token_budget, starting
+    at its first unit with a query term and ending at a word boundary. If that
+    would cut off the term itself, the passage starts a few words before it.
+
+    Returns:
+        dict: The shortened candidate, or None if fewer than PACK_MIN_WORDS words fit
+    """
+    chunk, units, last = candidate['chunk'], candidate['units'], candidate['last']
+    first = next((i for i in range(candidate['first'], last + 1)
+                  if not weights.keys().isdisjoint(tokenize(" ".join(units[i])))), candidate['first'])
+    matches = [i for i, word in enumerate(units[first]) if not weights.keys().isdisjoint(tokenize(word))]
+    separator = "\n" if chunk.get('sheet') else " "
+
+    def passage(skip, count):
+        parts = []
+        for unit in [units[first][skip:]] + units[first + 1:last + 1]:
+            if parts and count <= 0:
+                break
+            parts.append(" ".join(unit[:count]))
+            count -= len(unit)
+        text = separator.join(parts)
+        return ("... " if first > 0 or skip > 0 else "") + text + (" ..." if count < 0 or last < len(units) - 1 else "")
+
+    def tokens(text):
+        return estimate_tokens(f"Source: {chunk['source']}\nContent: {text}\n\n---\n\n")
+
+    def fit(skip):
+        low, high = 0, sum(len(unit) for unit in units[first:last + 1]) - skip
+        while low < high:
+            middle = (low + high + 1) // 2
+            if tokens(passage(skip, middle)) <= token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    skip, count = 0, fit(0)
+    if matches and count <= matches[0]:
+        skip = max(0, matches[0] - PACK_MIN_WORDS // 2)
+        count = fit(skip)
+    if count < PACK_MIN_WORDS:
+        return None
+    text = passage(skip, count)
+    words = [word for unit in [units[first][skip:]] + units[first + 1:last + 1] for word in unit]
+    return dict(candidate, first=first, text=text, tokens=tokens(text), shingles=_word_shingles(words[:count]))
+
+def pack_context(question, chunks, token_budget=CONTEXT_TOKEN_BUDGET, snippet_words=SNIPPET_WORDS,
+                 diversity=MMR_LAMBDA):
+    """
+    Cut retrieved chunks down to the passages that matter and pack them into a token budget.
+
+    Windows of up to snippet_words words around each sentence containing a query
+    term become candidate passages, scored by how rare their matched terms are
+    among the candidates and by the rank of their chunk. Chunks without any
+    query term (dense matches) offer their opening passage. Passages are then
+    picked by maximal marginal relevance, with similarity measured as overlap of
+    word trigrams, so text repeated by overlapping chunks is sent once and
+    near-duplicates are dropped. A passage too long for what is left of the
+    budget is cut down to fit (see _trim_passage), so even a small budget gets
+    part of the best passage. Picking stops when nothing else fits.
+
+    Returns:
+        list: Chunk dicts carrying their chunk's metadata, with the passage as content
+    """
+    query_terms = set(tokenize(question))
+    chunk_units = []
+    for chunk in chunks:
+        units = split_passage_units(chunk, snippet_words)
+        chunk_units.append((units, [Counter(tokenize(" ".join(unit))) for unit in units]))
+    
+    num_units = sum(len(units) for units, _ in chunk_units) or 1
+    doc_freq = Counter(term for _, unit_terms in chunk_units for terms in unit_terms for term in terms.keys() & query_terms)
+    weights = {term: math.log(1 + num_units / count) for term, count in doc_freq.items()}
+    
+    candidates = []
+    for rank, (chunk, (units, unit_terms)) in enumerate(zip(chunks, chunk_units)):
+        if not units:
+            continue
+        sizes = [len(unit) for unit in units]
+        seeds = [i for i, terms in enumerate(unit_terms) if not terms.keys().isdisjoint(weights)] or [0]
+        for first, last in sorted({_expand_window(sizes, seed, snippet_words) for seed in seeds}):
+            terms = Counter()
+            for unit in unit_terms[first:last + 1]:
+                terms.update({term: unit[term] for term in weights if term in unit})
+            relevance = sum(weight * (1 + math.log(terms[term])) for term, weight in weights.items() if terms[term])
+            candidates.append({'chunk': chunk, 'units': units, 'rank': rank, 'first': first, 'last': last,
+                               'relevance': relevance})
+    if not candidates:
+        return []
+    
+    top_relevance = max(candidate['relevance'] for candidate in candidates) or 1.0
+    for candidate in candidates:
+        # Term matches dominate; the retriever's rank breaks ties and lifts dense-only matches
+        candidate['score'] = 0.8 * candidate['relevance'] / top_relevance + 0.2 / (1 + candidate['rank'])
+    # Only the best windows can make it into the budget; skip building text for the rest
+    candidates = heapq.nlargest(PACK_CANDIDATES, candidates, key=lambda c: c['score'])
+    for candidate in candidates:
+        chunk, units, first, last = candidate['chunk'], candidate['units'], candidate['first'], candidate['last']
+        separator = "\n" if chunk.get('sheet') else " "
+        text = separator.join(" ".join(unit) for unit in units[first:last + 1])
+        candidate['text'] = ("... " if first > 0 else "") + text + (" ..." if last < len(units) - 1 else "")
+        candidate['shingles'] = _word_shingles([word for unit in units[first:last + 1] for word in unit])
+        candidate['tokens'] = estimate_tokens(f"Source: {chunk['source']}\nContent: {candidate['text']}\n\n---\n\n")
+        candidate['redundancy'] = 0.0
+    
+    selected = []
+    used = 0
+    while candidates:
+        best = max(candidates, key=lambda c: diversity * c['score'] - (1 - diversity) * c['redundancy'])
+        candidates.remove(best)
+        if best['redundancy'] >= DUPLICATE_SIMILARITY:
+            continue
+        if used + best['tokens'] > token_budget:
+            best = _trim_passage(best, token_budget - used, weights)
+            if best is None:
+                continue
+        selected.append(best)
+        used += best['tokens']
+        for candidate in candidates:
+            if candidate['rank'] == best['rank'] and candidate['first'] <= best['last'] and best['first'] <= candidate['last']:
+                # Overlapping windows of the same chunk would repeat text
+                candidate['redundancy'] = 1.0
+            else:
+                candidate['redundancy'] = max(candidate['redundancy'], _shingle_similarity(candidate['shingles'], best['shingles']))
+    
+    # Present passages of the same chunk in document order
+    selected.sort(key=lambda c: (c['rank'], c['first']))
+    return [dict(c['chunk'], content=c['text']) for c in selected]
+
+# --- Response Cache ---
+def normalize_question(question):
+    """Lowercase, strip punctuation and collapse whitespace so trivially different questions match"""
+    return " ".join(TOKEN_PATTERN.findall(question.lower()))
+
+class ResponseCache:
+    """
+    Two-level cache of chat answers: an in-memory LRU in front of an SQLite store
+    with a TTL and a cap on the number of stored entries.
+
+    Keys include the IDs of the retrieved chunks, which are derived from chunk
+    content, so any knowledge-base change that affects an answer's context
+    produces a different key and the old entry is never served.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, memory_size=256, max_entries=10000, ttl=RESPONSE_CACHE_TTL):
+        self.memory = OrderedDict()
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+        self.lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, latency REAL, tokens INTEGER, created REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self.db.commit()
+
+    @staticmethod
+    def make_key(model, temperature, question, chunks, history):
+        """Hash everything that determines an answer into a cache key"""
+        key_data = json.dumps({
+            "model": model,
+            "temperature": temperature,
+            "question": normalize_question(question),
+            "chunks": [chunk_id(chunk) for chunk in chunks],
+            "history": history,
+        }, sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached response for key, or None"""
+        with self.lock:
+            now = time.time()
+            entry = self.memory.get(key)
+            if entry is not None and now - entry[3] < self.ttl:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+            else:
+                self.memory.pop(key, None)
+                row = self.db.execute(
+                    "SELECT response, latency, tokens, created FROM responses WHERE key = ? AND created > ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                entry = tuple(row) if row else None
+                if entry is not None:
+                    self._remember(key, entry)
             
-            if file_extension in supported_extensions:
-                console.print(f"[blue]Processing {file_path}...[/blue]")
-                
-                content = ""
-                if file_extension == '.pdf':
-                    content = extract_text_from_pdf(file_path)
-                elif file_extension == '.docx':
-                    content = extract_text_from_docx(file_path)
-                elif file_extension in ['.xlsx', '.xls']:
-                    content = extract_text_from_excel(file_path)
-                elif file_extension in ['.txt', '.md']:
-                    content = extract_text_from_txt(file_path)
-                
-                if content:
-                    # Split document into chunks to make retrieval more effective
-                    chunks = split_text_into_chunks(content, file_path)
-                    documents.extend(chunks)
-                    files_processed += 1
-    
-    console.print(Panel(f"[green]Successfully processed {files_processed} files[/green]", border_style="green"))
-    return documents
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            self.saved_tokens += entry[2]
+            return entry[0]
 
-def split_text_into_chunks(text, source_file, chunk_size=1000, overlap=100):
-    """Split text into smaller chunks for better retrieval"""
-    chunks = []
-    words = text.split()
-    
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk_words = words[i:i + chunk_size]
-        chunk_text = ' '.join(chunk_words)
-        
-        # Skip very short chunks
-        if len(chunk_text.strip()) > 50:
-            chunks.append({
-                'content': chunk_text,
-                'source': source_file
-            })
-    
-    return chunks
+    def put(self, key, response, latency, tokens):
+        """Store a response with the latency and token count it cost to produce"""
+        with self.lock:
+            entry = (response, latency, tokens, time.time())
+            self._remember(key, entry)
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key,) + entry)
+            # Expire old entries and keep only the newest max_entries
+            self.db.execute("DELETE FROM responses WHERE created <= ?", (entry[3] - self.ttl,))
+            self.db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.db.commit()
+
+    def stats(self):
+        """Hit/miss counters and the API latency and tokens saved by hits"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "saved_tokens": self.saved_tokens,
+        }
 
-def get_relevant_context(documents, question, max_chunks=3):
+# --- Retrieval Cache ---
+def normalize_query(question):
     """
-    Simple context retrieval based on keyword matching.
-    In a more advanced version, you might use embedding similarity.
+    The question as retrieval sees it: its non-stopword terms, lowercased and sorted.
+    Every retriever and pack_context treat a question as a bag of these terms, so
+    questions with the same normalized form retrieve the same passages.
     """
-    if not documents:
-        return ""
-    
-    # Convert question to lowercase for case-insensitive matching
-    question_lower = question.lower()
-    
-    # Simple keyword matching to find relevant chunks
-    relevant_chunks = []
-    for doc in documents:
-        # Count matches of question words in the document
-        doc_content_lower = doc['content'].lower()
-        match_count = sum(1 for word in question_lower.split() if word in doc_content_lower)
-        
-        if match_count > 0:
-            relevant_chunks.append((match_count, doc))
-    
-    # Sort by match count and take top chunks
-    relevant_chunks.sort(key=lambda x: x[0], reverse=True)
-    top_chunks = relevant_chunks[:max_chunks]
-    
-    # Format context with source information
-    context_parts = []
-    for _, chunk in top_chunks:
-        context_parts.append(f"Source: {chunk['source']}\nContent: {chunk['content']}")
-    
-    return "\n\n---\n\n".join(context_parts) if context_parts else "No relevant context found."
+    return " ".join(sorted(tokenize(question)))
+
+class RetrievalCache:
+    """
+    In-memory LRU of retrieval results keyed on the normalized question and the
+    knowledge base generation.
+
+    The generation changes whenever the knowledge base is reloaded or updated,
+    so results retrieved from older documents are never served again and are
+    evicted as new ones come in.
+    """
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_SIZE):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                metrics.count("retrieval.cache_misses")
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            metrics.count("retrieval.cache_hits")
+            return entry[0]
+
+    def put(self, key, result, seconds):
+        """Store a result with the time it took to compute"""
+        with self.lock:
+            self.entries[key] = (result, seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Hit/miss counters, size and the retrieval time saved by hits"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries),
+            "evictions": self.evictions,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
 
 # --- UI Class ---
 class UI:
@@ -293,10 +2720,12 @@ class UI:
         """Gets user input with a styled prompt."""
         return self.console.input(f"[bold yellow]=>[/bold yellow] [bold white]{prompt}:[/bold white] ")
 
+    @metrics.timed("ui.render")
     def display_markdown_message(self, title: str, content: str):
         """
         Displays content as Markdown.
         """
+        from rich.markdown import Markdown
         panel_title = f"[bold cyan]{title}[/bold cyan]"
         
         if content:
@@ -309,24 +2738,523 @@ class UI:
             # Handle cases where the stream was empty or failed
             self.display_message(title, "No response received from the API.", "red")
 
+    def display_markdown_stream(self, title: str, deltas, refresh_interval: float = 0.05) -> str:
+        """
+        Renders streamed text as Markdown in a live-updating panel.
+        Re-renders at most once per refresh_interval and returns the full text.
+        """
+        from rich.live import Live
+        from rich.markdown import Markdown
+        panel_title = f"[bold cyan]{title}[/bold cyan]"
+        parts = []
+        
+        render_seconds = 0.0
+        
+        def render():
+            content = "".join(parts).strip()
+            if not content:
+                return Panel(Text("AI is thinking...", style="blue"), title=panel_title, border_style="cyan")
+            return Panel(Markdown(content, style="bright_blue"), title=panel_title, border_style="cyan")
+        
+        def refresh(live):
+            nonlocal render_seconds
+            started = time.perf_counter()
+            live.update(render(), refresh=True)
+            render_seconds += time.perf_counter() - started
+        
+        with Live(render(), console=self.console, auto_refresh=False, vertical_overflow="visible") as live:
+            last_render = 0.0
+            for delta in deltas:
+                parts.append(delta)
+                now = time.monotonic()
+                if now - last_render >= refresh_interval:
+                    refresh(live)
+                    last_render = now
+            refresh(live)
+        
+        # Time spent rendering only, excluding waiting for tokens
+        if metrics.enabled:
+            metrics.record("ui.render_stream", render_seconds)
+        
+        content = "".join(parts)
+        if not content:
+            self.display_message(title, "No response received from the API.", "red")
+        return content
+
+# --- Conversation History ---
+def estimate_tokens(text):
+    """Rough token count for budgeting (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+def count_message_tokens(messages):
+    """Estimated tokens for a list of chat messages, including per-message overhead"""
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+def trim_history(turns, token_budget):
+    """
+    Keep the most recent messages that fit in token_budget.
+    Whole user/assistant pairs are dropped from the oldest end so a reply is never
+    sent without the question it answered.
+    """
+    kept = []
+    used = 0
+    for i in range(len(turns) - 2, -1, -2):
+        pair = turns[i:i + 2]
+        pair_tokens = count_message_tokens(pair)
+        if used + pair_tokens > token_budget:
+            break
+        kept[:0] = pair
+        used += pair_tokens
+    return kept
+
+# --- Conversation Sessions ---
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+SESSION_FRAME = struct.Struct("<I")
+
+class SessionLog:
+    """
+    One conversation, saved as an append-only log of length-prefixed records.
+
+    Each record is a JSON turn ({"user": ..., "assistant": ...}) with its byte
+    length written before and after it. The trailing length lets the log be
+    read backwards, so resuming reads only the newest turns that fit
+    `token_budget` however long the conversation has grown, and only that
+    window is kept in memory.
+
+    Once the log grows past twice SESSION_LOG_MAX_BYTES it is compacted: the
+    newest records, up to SESSION_LOG_MAX_BYTES, are copied to a fresh file
+    that replaces it. With path None the conversation is kept in memory only.
+    """
+
+    def __init__(self, session_id, path=None, token_budget=HISTORY_TOKEN_BUDGET):
+        self.id = session_id
+        self.path = path
+        self.token_budget = token_budget
+        self.window = []  # messages of the newest turns that fit token_budget
+        self.size = 0
+        if path and os.path.exists(path):
+            self._resume()
+
+    @staticmethod
+    def _records_backwards(f, end):
+        """Yield (start, end, record) from the record ending at `end` back to the start of the file"""
+        header = SESSION_FRAME.size
+        while end > 0:
+            if end < 2 * header:
+                raise ValueError("truncated session record")
+            f.seek(end - header)
+            (length,) = SESSION_FRAME.unpack(f.read(header))
+            start = end - length - 2 * header
+            if start < 0:
+                raise ValueError("truncated session record")
+            f.seek(start)
+            if SESSION_FRAME.unpack(f.read(header)) != (length,):
+                raise ValueError("corrupt session record")
+            yield start, end, json.loads(f.read(length))
+            end = start
+
+    def _resume(self):
+        turns = []
+        used = 0
+        with open(self.path, 'rb') as f:
+            self.size = f.seek(0, os.SEEK_END)
+            try:
+                for _, _, record in self._records_backwards(f, self.size):
+                    pair = [{"role": "user", "content": record['user']}, {"role": "assistant", "content": record['assistant']}]
+                    used += count_message_tokens(pair)
+                    if used > self.token_budget:
+                        break
+                    turns.append(pair)
+            except ValueError:
+                turns = None
+        if turns is None:
+            # A write cut short (e.g. by a crash) leaves a torn last record
+            self._truncate_to_valid()
+            return self._resume()
+        self.window = [message for pair in reversed(turns) for message in pair]
+
+    def _truncate_to_valid(self):
+        """Drop everything after the last complete record; reads the whole log, so only used for recovery"""
+        header = SESSION_FRAME.size
+        valid = 0
+        with open(self.path, 'r+b') as f:
+            while True:
+                head = f.read(header)
+                if len(head) < header:
+                    break
+                payload = f.read(SESSION_FRAME.unpack(head)[0])
+                if f.read(header) != head:
+                    break
+                try:
+                    json.loads(payload)
+                except ValueError:
+                    break
+                valid = f.tell()
+            f.truncate(valid)
+        metrics.count("session.recovered_logs")
+
+    def _append(self, record):
+        payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        frame = SESSION_FRAME.pack(len(payload)) + payload + SESSION_FRAME.pack(len(payload))
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(frame)
+        self.size += len(frame)
+
+    def touch(self):
+        """Write the log file now, empty, so the session can be resumed before its first turn"""
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            open(self.path, 'ab').close()
+
+    def add_turn(self, user_message, assistant_message):
+        """Append a completed exchange and slide the resident window forward"""
+        self._append({"user": user_message, "assistant": assistant_message})
+        turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+        self.window = trim_history(self.window + turn, self.token_budget)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.path and self.size > 2 * SESSION_LOG_MAX_BYTES:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log with only its newest records, up to SESSION_LOG_MAX_BYTES"""
+        frames = []
+        kept = 0
+        tmp_path = self.path + ".tmp"
+        with open(self.path, 'rb') as f:
+            for start, end, record in self._records_backwards(f, self.size):
+                if frames and kept + end - start > SESSION_LOG_MAX_BYTES:
+                    break
+                frames.append((start, end))
+                kept += end - start
+            with open(tmp_path, 'wb') as out:
+                for start, end in reversed(frames):
+                    f.seek(start)
+                    out.write(f.read(end - start))
+        os.replace(tmp_path, self.path)
+        self.size = kept
+        metrics.count("session.compactions")
+
+class SessionStore:
+    """Saved conversations: one SessionLog file per session ID in `directory`"""
+
+    def __init__(self, directory=SESSIONS_DIR):
+        self.directory = directory
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.log") if self.directory else None
+
+    def create(self, token_budget=HISTORY_TOKEN_BUDGET):
+        """Start a new conversation; its log file is written with the first turn"""
+        session_id = uuid.uuid4().hex
+        return SessionLog(session_id, self._path(session_id), token_budget)
+
+    def open(self, session_id, token_budget=HISTORY_TOKEN_BUDGET):
+        """Resume a saved conversation, or return None if there is none with this ID"""
+        if not self.directory or not SESSION_ID_PATTERN.fullmatch(session_id):
+            return None
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return None
+        return SessionLog(session_id, path, token_budget)
+
+    def delete(self, session_id):
+        if self.directory and SESSION_ID_PATTERN.fullmatch(session_id):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(session_id))
+
+    def recent(self, limit=10):
+        """(session ID, last modified time) of the most recently used saved conversations"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        sessions = [(entry.name[:-len(".log")], entry.stat().st_mtime) for entry in os.scandir(self.directory)
+                    if entry.name.endswith(".log") and SESSION_ID_PATTERN.fullmatch(entry.name[:-len(".log")])]
+        return heapq.nlargest(limit, sessions, key=lambda item: item[1])
+
+# --- Live Knowledge Base ---
+class KnowledgeBase:
+    """
+    Loaded documents and their retriever, shared by every conversation in a process.
+
+    Loading can run on a background thread; `ready` is set once it has finished.
+    Searches and updates both hold `lock`, so a search never sees half an update.
+    `generation` goes up with every load and update; it keys `retrieval_cache`.
+    """
+
+    def __init__(self, background: bool = False, watch: bool = False):
+        self.documents = ChunkStore.from_documents([])
+        self.retriever = None
+        self.deduplicator = None
+        self.generation = 0
+        self.retrieval_cache = RetrievalCache() if RETRIEVAL_CACHE_SIZE > 0 else None
+        self.ready = threading.Event()
+        self.load_report = []  # panels from background loading, shown before the next answer
+        self.lock = threading.Lock()
+        self.watcher = KnowledgeBaseWatcher(self) if watch else None
+        self.closed = False
+        self.reload(background)
+
+    def reload(self, background: bool = False):
+        """
+        (Re)load the knowledge base and rebuild the retriever.
+        With background=True this runs on a daemon thread and questions wait for it
+        only when they need retrieval. If loading fails, a reload keeps serving the
+        documents loaded before; only a first load falls back to an empty store.
+        """
+        self.ready.clear()
+        if background:
+            threading.Thread(target=self._load, args=(True,), daemon=True).start()
+        else:
+            self._load(False)
+
+    def _load(self, quiet: bool):
+        report = [] if quiet else None
+        cache = KnowledgeBaseCache()
+        deduplicator = ChunkDeduplicator(cache.cache_dir) if DEDUP_THRESHOLD > 0 else None
+        try:
+            documents = load_knowledge_base(report=report, cache=cache, deduplicator=deduplicator)
+            retriever = build_retriever(documents)
+        except Exception as e:
+            message = Panel(f"[red]Failed to load knowledge base: {e}[/red]", border_style="red")
+            if quiet:
+                report.append(message)
+            else:
+                console.print(message)
+            if self.retriever is not None:
+                # The watcher's cache still matches the documents kept, so it carries on as before
+                self.load_report.extend(report or [])
+                self.ready.set()
+                return
+            documents = ChunkStore.from_documents([])
+            retriever = build_retriever(documents)
+            cache.files = {}
+            deduplicator = None
+        with self.lock:
+            self.documents, self.retriever, self.deduplicator = documents, retriever, deduplicator
+            self.generation += 1
+        self.load_report.extend(report or [])
+        self.ready.set()
+        # A load still running when the knowledge base was closed must not start watching again
+        if self.watcher and not self.closed:
+            self.watcher.reset(cache)
+            self.watcher.start()
+
+    def apply_changes(self, documents, removed_ids, added_ids):
+        """Swap in an updated store, updating the retriever with just the chunks that left or joined the index"""
+        with self.lock:
+            self.retriever.apply_delta(documents, removed_ids, added_ids)
+            self.documents = documents
+            self.generation += 1
+
+    def search(self, question, max_chunks=3):
+        """Return the chunks most relevant to a question, waiting for loading to finish"""
+        self.ready.wait()
+        with self.lock:
+            return [doc for _, doc in self.retriever.search(question, max_chunks)]
+
+    def summary(self):
+        """System message text announcing the knowledge base size, or None if it is empty"""
+        count = self.documents.live_count()
+        return f"Knowledge base loaded with {count} document chunks." if count else None
+
+    def close(self):
+        """Stop watching the knowledge folder"""
+        self.closed = True
+        if self.watcher:
+            self.watcher.stop()
+
+class KnowledgeBaseWatcher:
+    """
+    Polls the knowledge folder and applies added, changed and removed files to a
+    KnowledgeBase.
+
+    Only those files are extracted again. Their old chunks are hidden and the
+    new ones appended (see LayeredChunkStore), and the retriever applies the
+    same delta, so an update costs what changed rather than the whole corpus.
+    Once updates amount to KB_COMPACT_RATIO of the base store, the next one
+    reloads the knowledge base through the on-disk cache, which also persists it.
+
+    `cache` is the KnowledgeBaseCache the current store was loaded with; the
+    watcher keeps its file entries in step with the live store but never saves it.
+    """
+
+    def __init__(self, knowledge, knowledge_folder=KNOWLEDGE_FOLDER, interval=KB_WATCH_INTERVAL):
+        self.knowledge = knowledge
+        self.knowledge_folder = knowledge_folder
+        self.interval = interval
+        self.cache = None
+        self.failed = {}  # path -> (size, mtime_ns) of files that could not be read
+        self.lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reset(self, cache):
+        """Adopt the file list of a freshly loaded knowledge base as the baseline"""
+        with self.lock:
+            self.cache = cache
+            # Files the load could not read are retried only once they change
+            self.failed = {path: (stat.st_size, stat.st_mtime_ns)
+                           for path, stat in scan_knowledge_folder(self.knowledge_folder).items()
+                           if path not in cache.files}
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.knowledge.load_report.append(Panel(f"[red]Knowledge base update failed: {e}[/red]", border_style="red"))
+
+    def poll(self):
+        """
+        Scan the folder once and apply any changes.
+
+        Returns:
+            tuple: Lists of added, changed and removed file paths
+        """
+        with self.lock:
+            if self.cache is None:
+                return [], [], []
+            stats = scan_knowledge_folder(self.knowledge_folder)
+            added, changed = [], []
+            for path, stat in stats.items():
+                if path in self.cache.files:
+                    if not self.cache.lookup(path, stat):
+                        changed.append(path)
+                elif self.failed.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    added.append(path)
+            removed = [path for path in self.cache.files if path not in stats]
+            self.failed = {path: key for path, key in self.failed.items() if path in stats}
+            if added or changed or removed:
+                with metrics.span("ingest.delta", files=len(added) + len(changed) + len(removed)):
+                    self._apply(stats, added, changed, removed)
+            return added, changed, removed
+
+    def _apply(self, stats, added, changed, removed):
+        documents = self.knowledge.documents
+        if isinstance(documents, LayeredChunkStore) and \
+                documents.stale_count() + len(documents.overlay) > KB_COMPACT_RATIO * len(documents.base):
+            self.knowledge._load(quiet=True)
+            return
+        
+        removed_ids = []
+        for path in changed + removed:
+            first, count = self.cache.chunk_range(path)
+            removed_ids.extend(range(first, first + count))
+        
+        to_process = added + changed
+        os.makedirs(self.cache.cache_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="ingest-", dir=self.cache.cache_dir) as scratch:
+            new_stores, errors = ingest_files(to_process, scratch)
+            metrics.count("ingest.files_extracted", len(to_process))
+            stores = []
+            first = len(documents)
+            for path in to_process:
+                if path in errors:
+                    self.failed[path] = (stats[path].st_size, stats[path].st_mtime_ns)
+                    continue
+                self.cache.update(path, stats[path], first, len(new_stores[path]))
+                first += len(new_stores[path])
+                stores.append(new_stores[path])
+            self.cache.keep_only(set(stats) - set(errors))
+            documents, added_ids = LayeredChunkStore.from_changes(documents, removed_ids, stores)
+        
+        hidden = 0
+        if self.knowledge.deduplicator:
+            live = documents.live_count()
+            documents, removed_ids, added_ids = self.knowledge.deduplicator.apply_delta(documents, removed_ids, added_ids)
+            hidden = live - documents.live_count()
+        self.knowledge.apply_changes(documents, removed_ids, added_ids)
+        
+        report = self.knowledge.load_report
+        if errors:
+            error_lines = "\n".join(f"{path}: {error}" for path, error in errors.items())
+            report.append(Panel(f"[red]{error_lines}[/red]", title="[bold red]Files that could not be read[/bold red]", border_style="red"))
+        merged = f", {hidden} near-duplicates merged" if hidden > 0 else ""
+        report.append(Panel(f"[green]Knowledge base updated: {len(added)} added, {len(changed)} changed, "
+                            f"{len(removed)} removed (+{len(added_ids)}/-{len(removed_ids)} chunks{merged})[/green]",
+                            border_style="green"))
+
 # --- API Client Class ---
 class LLMClient:
     """Handles all communication with the Large Language Model API."""
     
-    def __init__(self, api_key: str, ui: UI):
+    def __init__(self, api_key: str, ui: UI, background: bool = False, watch: bool = False, knowledge=None):
         self.ui = ui
-        self.documents = load_knowledge_base()
-        self.client = MistralAI(api_key)
+        self.knowledge = knowledge or KnowledgeBase(background, watch)
+        self.client = create_api_client(api_key)
         self.model = MODEL_NAME
-        self.messages = []
+        self.history_token_budget = HISTORY_TOKEN_BUDGET
+        # Raw conversation only: retrieved context is injected into the current turn and never stored
+        self.sessions = SessionStore()
+        self.session = self.sessions.create(self.history_token_budget)
+        self.context_token_budget = CONTEXT_TOKEN_BUDGET
+        self.last_request_tokens = 0
+        self.response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
 
         # Load custom prompt template
         self.custom_prompt = self.load_custom_prompt()
 
-        # Send initial context as first message
-        if self.documents:
-            context_summary = f"Knowledge base loaded with {len(self.documents)} document chunks."
-            self.messages.append({"role": "system", "content": context_summary})
+    @property
+    def documents(self):
+        return self.knowledge.documents
+
+    @property
+    def retriever(self):
+        return self.knowledge.retriever
+
+    @property
+    def messages(self):
+        """The newest turns of the conversation that fit the history token budget"""
+        return self.session.window
+
+    def new_session(self):
+        """Return a client for another conversation sharing this one's knowledge base, API connection and caches"""
+        session = copy.copy(self)
+        session.start_session()
+        session.last_request_tokens = 0
+        return session
+
+    def start_session(self, session_id=None):
+        """
+        Switch to a new conversation, or resume a saved one by ID.
+        Returns False (and stays in the current conversation) if there is no such session.
+        """
+        if session_id is None:
+            self.session = self.sessions.create(self.history_token_budget)
+            return True
+        session = self.sessions.open(session_id, self.history_token_budget)
+        if session is None:
+            return False
+        self.session = session
+        return True
+
+    def wait_until_ready(self):
+        """Block until the knowledge base is loaded, then show any messages from loading it"""
+        if not self.knowledge.ready.is_set():
+            self.ui.console.print("[blue]Loading knowledge base...[/blue]")
+            self.knowledge.ready.wait()
+        while self.knowledge.load_report:
+            self.ui.console.print(self.knowledge.load_report.pop(0))
+
+    def reset_conversation(self):
+        """Start a new conversation; the previous one stays saved and can be resumed by its ID"""
+        self.start_session()
+
+    def close(self):
+        self.knowledge.close()
 
     def load_custom_prompt(self):
         """Load the custom prompt template from file"""
@@ -338,38 +3266,100 @@ class LLMClient:
             return "You are a helpful AI assistant. Use the following context to answer the user's question.\n\nContext information:\n{context}\n\nUser question:\n{question}"
 
     def clear_history(self):
-        self.messages = []
-        # Reload documents and send context again
-        self.documents = load_knowledge_base()
-        if self.documents:
-            context_summary = f"Knowledge base loaded with {len(self.documents)} document chunks."
-            self.messages.append({"role": "system", "content": context_summary})
+        self.reset_conversation()
+        # Without a running watcher, pick up knowledge folder changes now; only changed files are re-read
+        watcher = self.knowledge.watcher
+        if watcher and watcher.interval <= 0:
+            threading.Thread(target=watcher.poll, daemon=True).start()
         self.ui.display_message("System", "New chat session started.", colors.INFO_BORDER)
 
+    def retrieve(self, question):
+        """Return the most relevant knowledge-base passages for a question, packed into the context budget"""
+        self.wait_until_ready()
+        cache = self.knowledge.retrieval_cache
+        if cache is None:
+            return pack_context(question, self.knowledge.search(question, CONTEXT_CANDIDATES), self.context_token_budget)
+        # Read the generation first: a result computed during an update must not be filed under the new one
+        key = (self.knowledge.generation, normalize_query(question), CONTEXT_CANDIDATES, self.context_token_budget)
+        passages = cache.get(key)
+        if passages is None:
+            started = time.perf_counter()
+            passages = pack_context(question, self.knowledge.search(question, CONTEXT_CANDIDATES), self.context_token_budget)
+            cache.put(key, passages, time.perf_counter() - started)
+        return list(passages)
+
     def get_relevant_context_for_question(self, question):
         """Get relevant context from knowledge base for a specific question"""
-        return get_relevant_context(self.documents, question)
+        return format_context(self.retrieve(question))
 
-    def get_response(self, user_prompt: str):
-        try:
-            # Get relevant context for the question
+    def build_user_message(self, user_prompt: str, chunks=None) -> str:
+        """Format the user's question with retrieved context using the custom prompt template"""
+        # Get relevant context for the question
+        if chunks is None:
             context = self.get_relevant_context_for_question(user_prompt)
+        else:
+            context = format_context(chunks)
 
-            # Format the prompt with context using the custom prompt template
-            if context and context != "No relevant context found.":
-                formatted_prompt = self.custom_prompt.format(context=context, question=user_prompt)
-            else:
-                # If no context found, just use the user question with a simplified prompt
-                formatted_prompt = f"You are a sulmans personel assistant. Answer the user's question: {user_prompt}"
+        # Format the prompt with context using the custom prompt template
+        if context and context != "No relevant context found.":
+            return self.custom_prompt.format(context=context, question=user_prompt)
+        # If no context found, just use the user question with a simplified prompt
+        return f"You are a sulmans personel assistant. Answer the user's question: {user_prompt}"
+
+    def build_request_messages(self, user_prompt: str, chunks=None) -> list:
+        """
+        Assemble the messages for one API call: the knowledge base summary, the most recent
+        raw turns that fit the history token budget, and the current question with
+        its retrieved context.
+        """
+        summary = self.knowledge.summary()
+        system = [{"role": "system", "content": summary}] if summary else []
+        request_messages = system + trim_history(self.messages, self.history_token_budget)
+        request_messages.append({"role": "user", "content": self.build_user_message(user_prompt, chunks)})
+        self.last_request_tokens = count_message_tokens(request_messages)
+        return request_messages
+
+    def prepare_request(self, user_prompt: str):
+        """
+        Retrieve context and build the request for a question.
 
-            # Append user message to messages
-            self.messages.append({"role": "user", "content": formatted_prompt})
+        Returns:
+            tuple: (request_messages, cache_key), where cache_key is None unless
+            the response cache is enabled
+        """
+        with metrics.span("turn.retrieval"):
+            chunks = self.retrieve(user_prompt)
+        with metrics.span("turn.prompt_format"):
+            request_messages = self.build_request_messages(user_prompt, chunks)
+        metrics.count("turn.request_tokens_estimated", self.last_request_tokens)
+        if self.response_cache is None:
+            return request_messages, None
+        # Earlier turns change the answer, so they are part of the key too
+        history = [(message['role'], message['content']) for message in request_messages[:-1]]
+        cache_key = ResponseCache.make_key(self.model, RESPONSE_TEMPERATURE, user_prompt, chunks, history)
+        return request_messages, cache_key
+
+    def record_turn(self, user_prompt: str, ai_message: str):
+        """Save a completed exchange to the session log without its injected context"""
+        self.session.add_turn(user_prompt, ai_message)
+
+    @metrics.timed("turn.total")
+    def get_response(self, user_prompt: str):
+        metrics.turn += 1
+        try:
+            request_messages, cache_key = self.prepare_request(user_prompt)
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    self.record_turn(user_prompt, cached)
+                    return cached
 
             # Call Mistral AI chat completions
+            started = time.perf_counter()
             response = self.client.chat_completion(
-                messages=self.messages,
+                messages=request_messages,
                 model=self.model,
-                temperature=0.7,
+                temperature=RESPONSE_TEMPERATURE,
                 max_tokens=1000
             )
 
@@ -378,8 +3368,11 @@ class LLMClient:
                 # Extract the AI's response
                 ai_message = response['choices'][0]['message']['content']
                 
-                # Append assistant message to messages
-                self.messages.append({"role": "assistant", "content": ai_message})
+                # Store the exchange in the history
+                self.record_turn(user_prompt, ai_message)
+                if cache_key:
+                    self.response_cache.put(cache_key, ai_message, time.perf_counter() - started,
+                                            self.last_request_tokens + estimate_tokens(ai_message))
                 
                 return ai_message
             else:
@@ -390,6 +3383,487 @@ class LLMClient:
             self.ui.display_message("API Error", error_msg, colors.ERROR_BORDER)
             return error_msg
 
+    def stream_response(self, user_prompt: str):
+        """
+        Yield the AI's response as it is generated.
+        The full text is added to the history once the stream finishes.
+        """
+        metrics.turn += 1
+        turn_started = time.perf_counter()
+        try:
+            request_messages, cache_key = self.prepare_request(user_prompt)
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    self.record_turn(user_prompt, cached)
+                    yield cached
+                    return
+
+            started = time.perf_counter()
+            parts = []
+            for delta in self.client.chat_completion_stream(
+                messages=request_messages,
+                model=self.model,
+                temperature=RESPONSE_TEMPERATURE,
+                max_tokens=1000
+            ):
+                if not parts and metrics.enabled:
+                    metrics.record("turn.first_token", time.perf_counter() - turn_started)
+                parts.append(delta)
+                yield delta
+
+            if parts:
+                ai_message = "".join(parts)
+                self.record_turn(user_prompt, ai_message)
+                if cache_key:
+                    self.response_cache.put(cache_key, ai_message, time.perf_counter() - started,
+                                            self.last_request_tokens + estimate_tokens(ai_message))
+
+        except Exception as e:
+            error_msg = f"An unexpected error occurred:\n{str(e)}"
+            self.ui.display_message("API Error", error_msg, colors.ERROR_BORDER)
+        finally:
+            if metrics.enabled:
+                metrics.record("turn.total", time.perf_counter() - turn_started)
+
+# --- Batch Mode ---
+class RateLimiter:
+    """
+    Async token buckets for requests per second and tokens per minute.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_second=0, tokens_per_minute=0):
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        # Room for at least one request, or rates below 1/s could never send one
+        self.request_capacity = max(1.0, float(requests_per_second))
+        self.request_allowance = self.request_capacity
+        self.token_allowance = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.requests_per_second:
+            self.request_allowance = min(self.request_capacity, self.request_allowance + elapsed * self.requests_per_second)
+        if self.tokens_per_minute:
+            self.token_allowance = min(self.tokens_per_minute, self.token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, tokens=0):
+        """Wait until one request and `tokens` tokens fit in both buckets"""
+        # Requests larger than the whole per-minute budget still go through once the bucket is full
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self.lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_second and self.request_allowance < 1:
+                    wait = max(wait, (1 - self.request_allowance) / self.requests_per_second)
+                if self.tokens_per_minute and self.token_allowance < tokens:
+                    wait = max(wait, (tokens - self.token_allowance) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_second:
+                self.request_allowance -= 1
+            if self.tokens_per_minute:
+                self.token_allowance -= tokens
+
+def read_batch_questions(input_path):
+    """
+    Read {"id", "question"} records from a JSONL file; ids default to the line number.
+
+    Returns (questions, invalid) where invalid lists (line number, reason) for lines
+    that are not valid JSON or have no question, so one bad line cannot stop a batch.
+    """
+    questions = []
+    invalid = []
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                invalid.append((line_number, f"invalid JSON: {e}"))
+                continue
+            if isinstance(record, str):
+                record = {"question": record}
+            if not isinstance(record, dict) or not isinstance(record.get("question"), str):
+                invalid.append((line_number, 'expected {"question": "..."}'))
+                continue
+            record.setdefault("id", line_number)
+            questions.append(record)
+    return questions, invalid
+
+def read_completed_ids(output_path):
+    """Return the ids already answered in an output checkpoint file"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                completed.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                # A partially written last line from an interrupted run
+                continue
+    return completed
+
+async def run_batch(llm_client, input_path, output_path, concurrency=BATCH_CONCURRENCY,
+                    requests_per_second=0, tokens_per_minute=0, max_tokens=1000):
+    """
+    Answer every question in input_path concurrently and append answers to output_path.
+
+    Each answer is written and flushed as soon as it arrives, so an interrupted
+    run resumes from where it stopped. Failed questions are not written and are
+    retried on the next run. Lines that are not a valid question are reported and
+    counted as failed.
+
+    Returns:
+        dict: Counts of answered, skipped and failed questions and elapsed time
+    """
+    questions, invalid = read_batch_questions(input_path)
+    for line_number, reason in invalid:
+        console.print(f"[red]Line {line_number} of {input_path} skipped: {reason}[/red]")
+    completed = read_completed_ids(output_path)
+    pending = [record for record in questions if str(record["id"]) not in completed]
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(requests_per_second, tokens_per_minute)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=concurrency))
+    write_lock = asyncio.Lock()
+    summary = {"answered": 0, "skipped": len(questions) - len(pending), "failed": len(invalid)}
+    started = time.perf_counter()
+    
+    with open(output_path, 'a', encoding='utf-8') as output:
+        async def answer(record):
+            async with semaphore:
+                question = record["question"]
+                request_started = time.perf_counter()
+                try:
+                    # Retrieval is CPU-bound and would stall every other question on the event loop
+                    content = await asyncio.to_thread(llm_client.build_user_message, question)
+                    messages = [{"role": "user", "content": content}]
+                    await limiter.acquire(estimate_tokens(messages[0]["content"]) + max_tokens)
+                    response = await asyncio.to_thread(
+                        llm_client.client.chat_completion,
+                        messages=messages,
+                        model=llm_client.model,
+                        temperature=RESPONSE_TEMPERATURE,
+                        max_tokens=max_tokens
+                    )
+                except Exception as e:
+                    console.print(f"[red]Question {record['id']} failed: {e}[/red]")
+                    response = None
+                
+                if not response or 'choices' not in response:
+                    summary["failed"] += 1
+                    return
+                result = {
+                    "id": record["id"],
+                    "question": question,
+                    "answer": response['choices'][0]['message']['content'],
+                    "latency": round(time.perf_counter() - request_started, 3),
+                }
+                async with write_lock:
+                    output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    output.flush()
+                summary["answered"] += 1
+        
+        await asyncio.gather(*(answer(record) for record in pending))
+    
+    summary["elapsed"] = round(time.perf_counter() - started, 3)
+    return summary
+
+# --- Server Mode ---
+class ServerSession:
+    """One conversation held by ChatServer"""
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = asyncio.Lock()  # one turn at a time, so history stays in order
+        self.last_used = time.monotonic()
+
+class ChatServer:
+    """
+    Local HTTP API serving many conversations from one process.
+
+    Each session is an LLMClient.new_session() with its own history, sharing one
+    loaded knowledge base, API connection pool and response cache. Turns run on
+    a pool of `workers` threads and further requests wait for a free worker.
+    Sessions idle for longer than `idle_timeout`, or least recently used beyond
+    `max_sessions`, are evicted from memory; their saved logs (see SessionLog)
+    let the next request for them, even after a restart, resume where they were.
+
+    Endpoints:
+        POST   /sessions                -> {"session_id": ...}
+        POST   /sessions/<id>/messages  {"message": ..., "stream": false} -> {"reply": ...},
+                                        or server-sent {"delta": ...} events ending in [DONE]
+        DELETE /sessions/<id>           (also deletes the saved log)
+        GET    /health                  -> session, worker and knowledge base counts, retrieval cache stats
+    """
+
+    def __init__(self, llm_client, workers=SERVER_WORKERS, max_sessions=SERVER_MAX_SESSIONS,
+                 idle_timeout=SERVER_SESSION_IDLE_TIMEOUT):
+        self.llm_client = llm_client
+        self.workers = workers
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()  # session id -> ServerSession, least recently used first
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.semaphore = None
+        self.listener = None
+        self.in_flight = 0
+        self.waiting = 0
+
+    # Sessions
+    def _admit(self, client):
+        self.evict_idle()
+        # Like evict_idle, never drop a session mid-turn: a resumed copy would append to the same log
+        idle = [session_id for session_id, session in self.sessions.items() if not session.lock.locked()]
+        excess = len(self.sessions) - self.max_sessions + 1
+        for session_id in idle[:max(0, excess)]:
+            del self.sessions[session_id]
+            metrics.count("server.sessions_evicted")
+        self.sessions[client.session.id] = session = ServerSession(client)
+        return session
+
+    def create_session(self):
+        client = self.llm_client.new_session()
+        # Saved right away, so the session can be resumed even if it is evicted before its first turn
+        client.session.touch()
+        self._admit(client)
+        metrics.count("server.sessions_created")
+        return client.session.id
+
+    def get_session(self, session_id):
+        """Return the session, resuming it from its saved log if it is not in memory, or None"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            client = self.llm_client.new_session()
+            if not client.start_session(session_id):
+                return None
+            metrics.count("server.sessions_resumed")
+            return self._admit(client)
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def evict_idle(self):
+        """Drop sessions unused for idle_timeout; they are ordered by last use, so this stops at the first active one"""
+        deadline = time.monotonic() - self.idle_timeout
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used > deadline or session.lock.locked():
+                break
+            del self.sessions[session_id]
+            metrics.count("server.sessions_evicted")
+
+    async def _evict_periodically(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(60.0, self.idle_timeout / 2)))
+            self.evict_idle()
+
+    # HTTP
+    @staticmethod
+    async def _read_request(reader):
+        """Return (method, path, headers, body), or None once the client has closed the connection"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > SERVER_MAX_BODY_BYTES:
+            raise ValueError("request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), urlparse(target).path, headers, body
+
+    @staticmethod
+    async def _send_json(writer, status, body, keep_alive=True):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+        writer.write((f"HTTP/1.1 {status} {reason.get(status, '')}\r\n"
+                      f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + data)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one keep-alive connection until either side closes it"""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.LimitOverrunError) as e:
+                    await self._send_json(writer, 400, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                metrics.count("server.requests")
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if not await self._dispatch(method, path, body, writer, keep_alive) or not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body, writer, keep_alive):
+        """Route one request; returns False if the connection must be closed afterwards"""
+        parts = [part for part in path.split('/') if part]
+        if parts == ['health']:
+            knowledge = self.llm_client.knowledge
+            await self._send_json(writer, 200, {
+                "status": "ok" if knowledge.ready.is_set() else "loading",
+                "sessions": len(self.sessions),
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "chunks": knowledge.documents.live_count(),
+                "retrieval_cache": knowledge.retrieval_cache.stats() if knowledge.retrieval_cache else None,
+            }, keep_alive)
+            return True
+        if parts == ['sessions'] and method == 'POST':
+            await self._send_json(writer, 200, {"session_id": self.create_session()}, keep_alive)
+            return True
+        if len(parts) in (2, 3) and parts[0] == 'sessions':
+            session = self.get_session(parts[1])
+            if session is None:
+                await self._send_json(writer, 404, {"error": "unknown or expired session"}, keep_alive)
+                return True
+            if len(parts) == 2 and method == 'DELETE':
+                self.sessions.pop(parts[1], None)
+                self.llm_client.sessions.delete(parts[1])
+                await self._send_json(writer, 200, {"deleted": parts[1]}, keep_alive)
+                return True
+            if parts[2:] == ['messages'] and method == 'POST':
+                return await self._chat(session, body, writer, keep_alive)
+            await self._send_json(writer, 405, {"error": "method not allowed"}, keep_alive)
+            return True
+        await self._send_json(writer, 404, {"error": "not found"}, keep_alive)
+        return True
+
+    async def _chat(self, session, body, writer, keep_alive):
+        try:
+            payload = json.loads(body or b'{}')
+            message = payload['message']
+            if not isinstance(message, str) or not message.strip():
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            await self._send_json(writer, 400, {"error": 'expected a JSON body like {"message": "..."}'}, keep_alive)
+            return True
+        
+        async with session.lock:
+            self.waiting += 1
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            try:
+                if payload.get('stream'):
+                    await self._stream(session.client, message, writer)
+                    return False
+                loop = asyncio.get_running_loop()
+                reply = await loop.run_in_executor(self.executor, session.client.get_response, message)
+            finally:
+                self.in_flight -= 1
+                self.semaphore.release()
+                session.last_used = time.monotonic()
+        await self._send_json(writer, 200, {"reply": reply, "request_tokens": session.client.last_request_tokens}, keep_alive)
+        return True
+
+    async def _stream(self, client, message, writer):
+        """Relay stream_response, running on a worker thread, to the client as server-sent events"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        
+        def produce():
+            try:
+                for delta in client.stream_response(message):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+        
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        producer = loop.run_in_executor(self.executor, produce)
+        sent = False
+        try:
+            while (delta := await queue.get()) is not None:
+                writer.write(f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n".encode('utf-8'))
+                await writer.drain()
+                sent = True
+            if not sent:
+                writer.write(f"data: {json.dumps({'error': 'Could not get a response from the AI.'})}\n\n".encode('utf-8'))
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+        finally:
+            # A client that went away stops the upstream stream instead of leaving it running
+            stop.set()
+            await producer
+
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Start listening on the running event loop and return the asyncio server"""
+        self.semaphore = asyncio.Semaphore(self.workers)
+        self._evictor = asyncio.create_task(self._evict_periodically())
+        self.listener = await asyncio.start_server(self.handle_connection, host, port)
+        return self.listener
+
+    async def close(self):
+        """Stop accepting connections and evicting sessions"""
+        self.listener.close()
+        self._evictor.cancel()
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT):
+        server = await self.start(host, port)
+        console.print(Panel(f"[green]Serving on http://{host}:{port} with {self.workers} workers[/green]",
+                            border_style="green"))
+        async with server:
+            await server.serve_forever()
+
+# --- API Key Verification ---
+def _api_key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+def is_api_key_verified(api_key):
+    """True if this key passed a /models check within API_KEY_VERIFY_TTL"""
+    try:
+        with open(VERIFIED_KEYS_PATH, 'r', encoding='utf-8') as f:
+            verified = json.load(f)
+    except (OSError, ValueError):
+        return False
+    verified_at = verified.get(_api_key_fingerprint(api_key))
+    return verified_at is not None and time.time() - verified_at < API_KEY_VERIFY_TTL
+
+def remember_verified_api_key(api_key):
+    """Record a successful verification; only a SHA-256 fingerprint of the key is stored"""
+    try:
+        with open(VERIFIED_KEYS_PATH, 'r', encoding='utf-8') as f:
+            verified = json.load(f)
+    except (OSError, ValueError):
+        verified = {}
+    verified[_api_key_fingerprint(api_key)] = time.time()
+    os.makedirs(os.path.dirname(VERIFIED_KEYS_PATH) or ".", exist_ok=True)
+    with open(VERIFIED_KEYS_PATH, 'w', encoding='utf-8') as f:
+        json.dump(verified, f)
+
 # --- Main Application Class ---
 class ChatApp:
     """The main application controller."""
@@ -398,6 +3872,12 @@ class ChatApp:
         self.ui = UI()
         self.llm_client = None
 
+    def _drop_client(self):
+        """Forget a client that failed verification, stopping its knowledge-base watcher"""
+        if self.llm_client:
+            self.llm_client.close()
+            self.llm_client = None
+
     def _setup(self) -> bool:
         load_dotenv(dotenv_path=ENV_FILE)
         api_key = os.getenv(API_KEY_NAME)
@@ -408,19 +3888,30 @@ class ChatApp:
                 return self._configure_key()
             return False
         
+        # Re-entering chat with the same key keeps the loaded client and knowledge base
+        if self.llm_client and self.llm_client.client.api_key == api_key:
+            self.llm_client.start_session()
+            return True
+        
         try:
+            # The knowledge base loads in the background while the key is checked and the user types
+            self._drop_client()
+            self.llm_client = LLMClient(api_key, self.ui, background=True, watch=True)
+            if is_api_key_verified(api_key):
+                return True
             self.ui.console.print("[magenta]Verifying API key...[/magenta]")
-            self.llm_client = LLMClient(api_key, self.ui)
             # Test API call
             models = self.llm_client.client.list_models()
             if models:
+                remember_verified_api_key(api_key)
                 self.ui.console.print("[green]API key verified.[/green]")
             else:
                 self.ui.console.print("[red]API key verification failed.[/red]")
+                self._drop_client()
                 return False
-            time.sleep(1.5)
             return True
         except Exception as e:
+            self._drop_client()
             error_msg = f"Failed to initialize API client: {str(e)}"
             if "401" in str(e):
                 error_msg += "\n\nThis usually means your API key is invalid. Please check your API key in the .env file."
@@ -454,15 +3945,7 @@ class ChatApp:
 
         self.ui.clear_screen()
         self.ui.display_message("System", "Custom GPT is online. Type '/help' for commands.", "magenta")
-        
-        # Initialize conversation history
-        conversation_history = [
-            {"role": "system", "content": "You are a sulmans AI assistant."}
-        ]
-        
-        # Add any context from knowledge base
-        if self.llm_client.messages:
-            conversation_history.extend(self.llm_client.messages[1:])  # Skip the system message we already added
+        self.ui.console.print(f"[dim]Session {self.llm_client.session.id} (continue it later with /resume)[/dim]")
 
         while True:
             prompt = self.ui.get_input("\nYou")
@@ -472,30 +3955,78 @@ class ChatApp:
             elif prompt.lower() == '/new':
                 self.ui.clear_screen()
                 self.llm_client.clear_history()
-                # Reset conversation history
-                conversation_history = [
-                    {"role": "system", "content": "You are a helpful AI assistant."}
-                ]
-                # Add any context from knowledge base
-                if self.llm_client.messages:
-                    conversation_history.extend(self.llm_client.messages[1:])
+                self.ui.console.print(f"[dim]Session {self.llm_client.session.id}[/dim]")
+                continue
+            elif prompt.lower().startswith('/resume'):
+                self._resume_session(prompt[len('/resume'):].strip())
                 continue
             elif prompt.lower() == '/help':
-                self.ui.display_message("Help", "Commands:\n  /new  - Start a new conversation\n  /exit - Exit the chat", "magenta")
+                self.ui.display_message("Help", "Commands:\n  /new          - Start a new conversation\n  /stats        - Show per-stage timings and token usage\n  /stats export - Write metrics in Prometheus text format\n  /cache        - Show response and retrieval cache statistics\n  /resume [id]  - List saved conversations, or continue one\n  /exit         - Exit the chat", "magenta")
+                continue
+            elif prompt.lower().startswith('/stats'):
+                self._show_stats(export=prompt.lower().strip() == '/stats export')
+                continue
+            elif prompt.lower() == '/cache':
+                cache = self.llm_client.response_cache
+                if cache is None:
+                    self.ui.display_message("Response Cache", "Response cache is disabled. Set RESPONSE_CACHE=1 to enable it.", "yellow")
+                else:
+                    stats = "\n".join(f"{name}: {value}" for name, value in cache.stats().items())
+                    self.ui.display_message("Response Cache", stats, "magenta")
+                cache = self.llm_client.knowledge.retrieval_cache
+                if cache is not None:
+                    stats = "\n".join(f"{name}: {value}" for name, value in cache.stats().items())
+                    self.ui.display_message("Retrieval Cache", stats, "magenta")
                 continue
             
-            # Add user message to conversation history
-            conversation_history.append({"role": "user", "content": prompt})
-            
-            # Get response from AI
-            self.ui.console.print("\n[blue]AI is thinking...[/blue]")
-            response = self.llm_client.get_response(prompt)
-            
-            # Display the response
-            self.ui.display_markdown_message("Custom GPT", response)
-            
-            # Add AI's response to conversation history
-            conversation_history.append({"role": "assistant", "content": response})
+            # Get response from AI; the client saves the exchange to the session log
+            if STREAM_RESPONSES:
+                # Render tokens as they arrive
+                response = self.ui.display_markdown_stream("Custom GPT", self.llm_client.stream_response(prompt))
+            else:
+                self.ui.console.print("\n[blue]AI is thinking...[/blue]")
+                response = self.llm_client.get_response(prompt)
+                
+                # Display the response
+                self.ui.display_markdown_message("Custom GPT", response)
+            self.ui.console.print(f"[dim]Request size: ~{self.llm_client.last_request_tokens} tokens[/dim]")
+
+    def _resume_session(self, session_id):
+        """Continue a saved conversation, or list the most recent ones when no ID is given"""
+        if not session_id:
+            sessions = self.llm_client.sessions.recent()
+            if not sessions:
+                self.ui.display_message("Sessions", "No saved conversations yet.", "yellow")
+                return
+            lines = [f"{saved_id}  {datetime.datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M}" for saved_id, mtime in sessions]
+            self.ui.display_message("Sessions", "\n".join(lines) + "\n\nType /resume <id> to continue one.", "magenta")
+        elif self.llm_client.start_session(session_id):
+            turns = len(self.llm_client.messages) // 2
+            self.ui.display_message("Sessions", f"Resumed session {session_id} ({turns} recent turns in context).", "green")
+        else:
+            self.ui.display_message("Sessions", f"No saved conversation with ID {session_id}.", "red")
+
+    def _show_stats(self, export=False):
+        """Display per-stage timings, counters and connection reuse for this session"""
+        if not metrics.enabled:
+            self.ui.display_message("Stats", "Metrics are disabled. Set METRICS=1 to enable them.", "yellow")
+            return
+        from rich.table import Table
+        summary = metrics.summary()
+        table = Table(title="Stage timings (ms)", border_style="magenta")
+        for column in ("stage", "count", "mean", "p50", "p95", "max"):
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        for name, stage in summary["stages"].items():
+            table.add_row(name, str(stage["count"]), f"{stage['mean_ms']:.1f}", f"{stage['p50_ms']:.1f}",
+                          f"{stage['p95_ms']:.1f}", f"{stage['max_ms']:.1f}")
+        self.ui.console.print(table)
+        
+        lines = [f"{name}: {value}" for name, value in sorted(summary["counters"].items())]
+        lines += [f"connection.{name}: {value}" for name, value in self.llm_client.client.connection_stats().items()]
+        self.ui.display_message("Counters", "\n".join(lines), "magenta")
+        if export:
+            path = metrics.write_prometheus()
+            self.ui.display_message("Stats", f"Metrics written to {path}", "green")
 
     def _about_us(self):
         self.ui.display_banner()
@@ -553,6 +4084,75 @@ This is a Custom GPT Chatbot with Knowledge Base Integration.
             time.sleep(1)
             self.ui.clear_screen()
 
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+HEAVY_MODULES = ("PyPDF2", "docx", "pandas", "openpyxl", "numpy", "rich.markdown", "rich.live")
+HEAVY_MODULES_AT_IMPORT = [name for name in HEAVY_MODULES if name in sys.modules]
+
+def startup_report():
+    """Print how long startup takes and which heavy modules had to be imported along the way"""
+    ui = UI()
+    started = time.perf_counter()
+    client = LLMClient("startup-report", ui, background=True)
+    until_prompt = time.perf_counter() - started
+    client.knowledge.ready.wait()
+    until_ready = time.perf_counter() - started
+    
+    lines = [
+        f"Module import:                 {IMPORT_SECONDS * 1000:8.1f} ms",
+        f"Client ready for first prompt: {until_prompt * 1000:8.1f} ms",
+        f"Knowledge base loaded:         {until_ready * 1000:8.1f} ms ({client.documents.live_count()} chunks)",
+        f"Heavy modules loaded at import:  {', '.join(HEAVY_MODULES_AT_IMPORT) or 'none'}",
+        f"Heavy modules loaded by now:     {', '.join(name for name in HEAVY_MODULES if name in sys.modules) or 'none'}",
+    ]
+    ui.display_message("Startup Report", "\n".join(lines), "green")
+
+def main():
+    parser = argparse.ArgumentParser(description="Custom GPT chatbot with knowledge base integration")
+    parser.add_argument("--batch", metavar="QUESTIONS_JSONL", help="answer questions from a JSONL file non-interactively")
+    parser.add_argument("--output", metavar="ANSWERS_JSONL", default="answers.jsonl", help="where batch answers are appended (default: answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="maximum requests in flight in batch mode")
+    parser.add_argument("--rps", type=float, default=0, help="batch requests per second limit (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="batch tokens per minute limit (0 = unlimited)")
+    parser.add_argument("--serve", action="store_true", help="serve many chat sessions over a local HTTP API")
+    parser.add_argument("--host", default=SERVER_HOST, help="server mode listen address")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="server mode listen port")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="chat turns processed at once in server mode")
+    parser.add_argument("--startup-report", action="store_true", help="measure import and startup time, then exit")
+    args = parser.parse_args()
+
+    if args.startup_report:
+        startup_report()
+        return
+
+    if not args.batch and not args.serve:
+        app = ChatApp()
+        app.run()
+        return
+
+    load_dotenv(dotenv_path=ENV_FILE)
+    api_key = os.getenv(API_KEY_NAME)
+    if not api_key:
+        console.print(f"[red]API key not found. Set {API_KEY_NAME} in {ENV_FILE}.[/red]")
+        sys.exit(1)
+    if args.serve:
+        llm_client = LLMClient(api_key, UI(), watch=True)
+        llm_client.client = create_api_client(api_key, pool_size=args.workers)
+        try:
+            asyncio.run(ChatServer(llm_client, workers=args.workers).serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+    
+    llm_client = LLMClient(api_key, UI())
+    llm_client.client = create_api_client(api_key, pool_size=args.concurrency)
+    summary = asyncio.run(run_batch(llm_client, args.batch, args.output, args.concurrency, args.rps, args.tpm))
+    console.print(Panel(
+        f"[green]Answered {summary['answered']}, skipped {summary['skipped']} already answered, "
+        f"failed {summary['failed']} in {summary['elapsed']}s[/green]\nAnswers written to {args.output}",
+        border_style="green"
+    ))
+    if summary["failed"]:
+        sys.exit(1)
+
 if __name__ == "__main__":
-    app = ChatApp()
-    app.run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Mistral AI API.
+
+Serves /v1/models and /v1/chat/completions (both plain JSON and server-sent
+event streams) from a background thread, so the client can be exercised
+without network access or an API key. Streamed events are raw UTF-8 with no
+charset in the Content-Type, as real servers send them, so a non-ASCII reply
+checks that clients decode the stream correctly:
+
+    with StubMistralServer(reply="Hello there") as server:
+        client = MistralAI("test-key")
+        client.base_url = server.base_url
+        print("".join(client.chat_completion_stream([{"role": "user", "content": "Hi"}])))
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this, Nagle + delayed ACK adds ~40ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.stub.model, "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        with stub.lock:
+            stub.requests.append(payload)
+            fail_status = stub.fail_statuses.pop(0) if stub.fail_statuses else None
+        if fail_status:
+            data = json.dumps({"error": "injected failure"}).encode("utf-8")
+            self.send_response(fail_status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if stub.retry_after is not None:
+                self.send_header("Retry-After", str(stub.retry_after))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        delay = stub.next_delay()
+        if delay:
+            time.sleep(delay)
+
+        tokens = stub.tokens()
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        if payload.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.flush()
+            if stub.first_token_delay:
+                time.sleep(stub.first_token_delay)
+            for i, token in enumerate(tokens):
+                event = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                if i == len(tokens) - 1:
+                    # Like the real API, usage arrives with the final event
+                    event["usage"] = usage
+                # Raw UTF-8 like real endpoints, and no charset in the Content-Type, so clients must not guess
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if stub.token_delay:
+                    time.sleep(stub.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+        else:
+            self._send_json(200, {
+                "object": "chat.completion",
+                "model": payload.get("model", stub.model),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+class StubMistralServer:
+    """
+    Fake Mistral endpoint on a free local port.
+
+    Args:
+        reply (str): Text returned for every chat completion
+        delay (float): Seconds to wait before answering a completion request
+        token_delay (float): Seconds to wait between streamed tokens
+        first_token_delay (float): Seconds between a stream's headers and its first token
+        model (str): Model id reported by /models
+        fail_statuses (list): Status codes returned, in order, before completions succeed
+        retry_after (float): Retry-After header value sent with injected failures
+        slow_fraction (float): Share of completions that are delayed a further slow_delay seconds
+        slow_delay (float): Extra delay for the slow share, to simulate tail latency
+        seed (int): Seed for choosing which completions are slow
+    """
+
+    def __init__(self, reply="This is a stub response.", delay=0.0, token_delay=0.0, model="mistral-small-latest",
+                 fail_statuses=None, retry_after=None, slow_fraction=0.0, slow_delay=0.0, seed=0, first_token_delay=0.0):
+        self.reply = reply
+        self.fail_statuses = list(fail_statuses or [])
+        self.retry_after = retry_after
+        self.delay = delay
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.model = model
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.random = random.Random(seed)
+        self.requests = []
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def next_delay(self):
+        """Seconds to wait before answering the next completion"""
+        with self.lock:
+            slow = self.slow_fraction and self.random.random() < self.slow_fraction
+        return self.delay + (self.slow_delay if slow else 0.0)
+
+    def tokens(self):
+        """Split the reply into word-sized tokens, keeping the whitespace"""
+        words = self.reply.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()